@@ -0,0 +1,888 @@
+"""Benchmarks for the detection pipeline
+
+Run from the repository root, e.g.
+
+    python benchmark.py headless --video Videos/Backup.mp4
+"""
+import argparse
+import os
+import time
+
+DEFAULT_VIDEO = "Videos/Backup.mp4"
+
+
+def bench_headless(args):
+    """Compare the GUI detect_vehicles path with headless analyze_video on the same clip"""
+    from vehicle_detection import VehicleDetector
+
+    detector = VehicleDetector(model_path=args.model)
+
+    start = time.perf_counter()
+    stats = detector.analyze_video(args.video, keep_frames=False)
+    headless_time = time.perf_counter() - start
+    frames = stats["frames_processed"]
+    print(f"headless: {frames} frames in {headless_time:.2f}s "
+          f"({frames / headless_time:.1f} fps), green time {stats['green_time']}s")
+
+    if args.skip_gui:
+        return
+    start = time.perf_counter()
+    green_time, _ = detector.detect_vehicles(args.video)
+    gui_time = time.perf_counter() - start
+    print(f"gui:      {frames} frames in {gui_time:.2f}s "
+          f"({frames / gui_time:.1f} fps), green time {green_time}s")
+    print(f"speedup:  {gui_time / headless_time:.2f}x")
+
+
+def bench_startup(args):
+    """Cold import, model load and first-inference latency"""
+    import subprocess
+    import sys
+
+    # Cold imports in fresh interpreters, so nothing is cached in this process
+    for module in ("vehicle_detection", "ultralytics"):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-c", f"import {module}"], check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+        print(f"cold import {module}: {time.perf_counter() - start:.2f}s")
+
+    import numpy as np
+    from vehicle_detection import VehicleDetector
+
+    frame = np.zeros((480, 640, 3), dtype=np.uint8)
+    for warm_up in (False, True):
+        start = time.perf_counter()
+        detector = VehicleDetector(model_path=args.model, lazy=True)
+        constructed = time.perf_counter() - start
+
+        start = time.perf_counter()
+        detector._load_model(warm_up=warm_up)
+        loaded = time.perf_counter() - start
+
+        start = time.perf_counter()
+        detector.model(frame, verbose=False)
+        first = time.perf_counter() - start
+        label = "with warm-up" if warm_up else "no warm-up"
+        print(f"{label:>12}: construct {constructed * 1000:.1f} ms, load {loaded:.2f}s, "
+              f"first inference {first * 1000:.1f} ms")
+
+
+def bench_backend(args):
+    """FPS and per-frame detection-count agreement of exported backends vs PyTorch"""
+    from vehicle_detection import VehicleDetector
+
+    reference = None
+    for backend in args.backends:
+        int8 = backend.endswith("-int8")
+        start = time.perf_counter()
+        detector = VehicleDetector(model_path=args.model, backend=backend.replace("-int8", ""), int8=int8)
+        load_time = time.perf_counter() - start
+        detector.analyze_video(args.video, keep_frames=False)  # warm-up
+        stats = detector.analyze_video(args.video)
+        counts = [frame["detections"] for frame in stats["frames"]]
+        reference = reference or counts
+        agreement = sum(a == b for a, b in zip(counts, reference)) / max(len(counts), 1)
+        print(f"{backend:>14}: load {load_time:5.2f}s, {stats['timings']['fps']:6.1f} fps, "
+              f"peak {stats['max_vehicles']}, per-frame count agreement {agreement:.1%}")
+
+
+def bench_batch(args):
+    """Headless frames/sec for each inference batch size"""
+    from vehicle_detection import VehicleDetector
+
+    detector = VehicleDetector(model_path=args.model)
+    # Warm up so the first timed run doesn't pay one-off setup costs
+    detector.analyze_video(args.video, keep_frames=False, batch_size=1)
+    baseline = None
+    for batch_size in args.sizes:
+        stats = detector.analyze_video(args.video, keep_frames=False, batch_size=batch_size)
+        fps = stats["timings"]["fps"]
+        baseline = baseline or fps
+        print(f"batch {batch_size:>3}: {fps:6.1f} fps  ({fps / baseline:.2f}x)  "
+              f"max vehicles {stats['max_vehicles']}")
+
+
+def bench_pipeline(args):
+    """Sequential headless analysis vs the threaded pipeline (no render stage)"""
+    from detection_pipeline import DetectionPipeline
+    from vehicle_detection import VehicleDetector
+
+    detector = VehicleDetector(model_path=args.model)
+    detector.analyze_video(args.video, keep_frames=False)  # warm-up
+
+    stats = detector.analyze_video(args.video, keep_frames=False)
+    print(f"sequential: {stats['timings']['fps']:.1f} fps, green time {stats['green_time']}s")
+
+    pipeline = DetectionPipeline(detector, args.video, display=False, queue_size=args.queue_size)
+    start = time.perf_counter()
+    green_time, _ = pipeline.run()
+    elapsed = time.perf_counter() - start
+    frames = pipeline.stage_stats["track"].items
+    print(f"pipelined:  {frames / elapsed:.1f} fps, green time {green_time}s")
+    for name, stage in pipeline.stats().items():
+        print(f"  {name:>6}: {stage['items_per_s']:6.1f} items/s, {stage['utilisation']:.0%} busy, "
+              f"max queue depth {stage['max_queue_depth']}")
+
+
+def bench_parallel(args):
+    """Four approach videos analysed one after another vs in a process pool"""
+    from vehicle_detection import VehicleDetector, analyze_videos_parallel
+
+    videos = args.videos or [args.video] * 4
+    detector = VehicleDetector(model_path=args.model)
+
+    start = time.perf_counter()
+    sequential = [detector.analyze_video(path, keep_frames=False)["green_time"] for path in videos]
+    sequential_time = time.perf_counter() - start
+    print(f"sequential: {sequential_time:.1f}s, green times {sequential}")
+
+    start = time.perf_counter()
+    parallel = [0] * len(videos)
+    for index, stats in analyze_videos_parallel(videos, torch_threads=args.torch_threads, model_path=args.model):
+        parallel[index] = stats["green_time"]
+        print(f"  road {index} done after {time.perf_counter() - start:.1f}s")
+    parallel_time = time.perf_counter() - start
+    print(f"parallel:   {parallel_time:.1f}s, green times {parallel}")
+    print(f"speedup:    {sequential_time / parallel_time:.2f}x, identical: {parallel == sequential}")
+
+
+def bench_stride(args):
+    """Speedup vs error in peak vehicle count for fixed and adaptive frame strides"""
+    from vehicle_detection import VehicleDetector
+
+    detector = VehicleDetector(model_path=args.model)
+    detector.analyze_video(args.video, keep_frames=False)  # warm-up
+
+    runs = [("every frame", dict())]
+    runs += [(f"stride {n}", dict(stride=n)) for n in (2, 4, 8)]
+    runs += [(f"adaptive <= {args.max_stride}", dict(adaptive_stride=True, max_stride=args.max_stride))]
+    baseline = None
+    for label, options in runs:
+        stats = detector.analyze_video(args.video, keep_frames=False, **options)
+        baseline = baseline or stats
+        speedup = baseline["timings"]["total_s"] / stats["timings"]["total_s"]
+        error = stats["max_vehicles"] - baseline["max_vehicles"]
+        print(f"{label:>14}: {stats['frames_processed']:>5} of {stats['frames_read']} frames analysed, "
+              f"{speedup:5.2f}x, peak {stats['max_vehicles']} ({error:+d}), green time {stats['green_time']}s")
+
+
+def bench_early_exit(args):
+    """Full-length analysis vs stopping once the green time has converged"""
+    from vehicle_detection import VehicleDetector
+
+    detector = VehicleDetector(model_path=args.model)
+    detector.analyze_video(args.video, keep_frames=False)  # warm-up
+
+    full = detector.analyze_video(args.video, keep_frames=False)
+    print(f"full video: {full['frames_read']} frames, {full['timings']['total_s']:.1f}s, "
+          f"green time {full['green_time']}s")
+    for window in args.windows:
+        stats = detector.analyze_video(args.video, keep_frames=False, early_exit=True,
+                                       tolerance=args.tolerance, window=window)
+        print(f"window {window:>4}: {stats['frames_read']} frames, {stats['timings']['total_s']:.1f}s "
+              f"({full['timings']['total_s'] / stats['timings']['total_s']:.2f}x), "
+              f"green time {stats['green_time']}s ({stats['green_time'] - full['green_time']:+d})")
+
+
+def bench_roi(args):
+    """Whole-frame vs ROI-cropped analysis: pixels per frame, frames/sec and counted vehicles"""
+    from vehicle_detection import RegionOfInterest, VehicleDetector
+
+    detector = VehicleDetector(model_path=args.model)
+    roi = RegionOfInterest.parse(args.roi)
+    for name, region in (("full", None), ("roi", roi)):
+        height, width = region.shape if region is not None else detector.imgsz
+        stats = detector.analyze_video(args.video, keep_frames=False, roi=region)
+        print(f"{name:>5}: {width}x{height} px/frame, {stats['timings']['fps']:.1f} fps, "
+              f"infer {stats['timings']['infer_s']:.2f}s, max vehicles {stats['max_vehicles']}, "
+              f"green time {stats['green_time']}s")
+
+
+def bench_motion(args):
+    """Frames skipped by the motion gate, speedup and green-time error per change threshold"""
+    from vehicle_detection import VehicleDetector
+
+    detector = VehicleDetector(model_path=args.model)
+    baseline = detector.analyze_video(args.video, keep_frames=False)
+    base_time = baseline["timings"]["total_s"]
+    print(f"{'min changed':>12} {'skipped':>8} {'speedup':>8} {'max vehicles':>13} {'green time':>11}")
+    print(f"{'off':>12} {0:>7.0%} {1:>7.2f}x {baseline['max_vehicles']:>13} {baseline['green_time']:>10}s")
+    for min_changed in args.thresholds:
+        detector.motion_gate_options = {"min_changed": min_changed}
+        stats = detector.analyze_video(args.video, keep_frames=False, motion_gate=True)
+        print(f"{min_changed:>12} {stats['skip_fraction']:>7.0%} {base_time / stats['timings']['total_s']:>7.2f}x "
+              f"{stats['max_vehicles']:>13} {stats['green_time']:>10}s")
+
+
+def bench_live(args):
+    """Live ingestion of the clip at its real frame rate: frames dropped, latency and query cost"""
+    from live_stream import LiveRoadMonitor
+    from vehicle_detection import VehicleDetector
+
+    detector = VehicleDetector(model_path=args.model)
+    with LiveRoadMonitor(detector, args.video, window_s=args.window, realtime=True) as monitor:
+        query_time = 0.0
+        queries = 0
+        deadline = time.monotonic() + args.seconds
+        while time.monotonic() < deadline and not monitor.ended:
+            start = time.perf_counter()
+            monitor.current_green_time()
+            query_time += time.perf_counter() - start
+            queries += 1
+            time.sleep(0.01)
+    stats = monitor.stats()
+    print(f"read {stats['frames_read']} frames, analysed {stats['frames_analysed']} "
+          f"({stats['analysed_fps']:.1f} fps), dropped {stats['drop_fraction']:.0%}")
+    print(f"capture-to-count latency: mean {stats['mean_latency_s'] * 1000:.0f} ms, "
+          f"max {stats['max_latency_s'] * 1000:.0f} ms")
+    print(f"current_green_time(): {query_time / max(queries, 1) * 1e6:.1f} us per call over {queries} calls")
+
+
+class ThreadTimers:
+    """after / after_cancel on threading.Timer, with time sped up by speed (for controllers outside Tk)"""
+
+    def __init__(self, speed=1.0):
+        import threading
+
+        self.speed = speed
+        self.lock = threading.RLock()  # Callbacks run one at a time, as on Tk's main loop
+
+    def clock(self):
+        return time.monotonic() * self.speed
+
+    def after(self, delay_ms, callback, *args):
+        import threading
+
+        def run():
+            with self.lock:
+                callback(*args)
+
+        timer = threading.Timer(delay_ms / 1000.0 / self.speed, run)
+        timer.daemon = True
+        timer.start()
+        return timer
+
+    def after_cancel(self, timer):
+        timer.cancel()
+
+
+def bench_overlap(args):
+    """Analyse-everything-first vs overlapped control: data age at actuation, idle time and total time"""
+    import threading
+
+    from junction_controller import OverlappedController
+    from signal_phases import PhaseScheduler, build_phase_plan
+
+    timers = ThreadTimers(args.speed)
+    green_times = [20, 35, 15, 50]
+
+    def measure(road):
+        time.sleep(args.analysis_s / args.speed)
+        return green_times[road], False
+
+    # Baseline: analyse every road, then run the whole plan on the results
+    done = threading.Event()
+    start = timers.clock()
+    measured_at = {}
+    for road in range(4):
+        measure(road)
+        measured_at[road] = timers.clock()
+    ages = {}
+
+    def on_phase(road, state, duration):
+        if state == "green":
+            ages[road] = timers.clock() - measured_at[road]
+
+    with timers.lock:
+        PhaseScheduler(timers.after, timers.after_cancel, on_phase, done.set, clock=timers.clock).start(
+            build_phase_plan(green_times))
+    done.wait()
+    print(f"sequential: total {timers.clock() - start:.0f}s, mean data age {sum(ages.values()) / 4:.0f}s, "
+          f"max data age {max(ages.values()):.0f}s, idle before first green {measured_at[3] - start:.0f}s")
+
+    done.clear()
+    start = timers.clock()
+    controller = OverlappedController(range(4), measure, timers.after, timers.after_cancel,
+                                      lambda road, state, duration: None, on_complete=done.set,
+                                      poll_ms=50 * args.speed, clock=timers.clock)
+    with timers.lock:
+        controller.start()
+    done.wait()
+    stats = controller.stats()
+    print(f"overlapped: total {timers.clock() - start:.0f}s, mean data age {stats['mean_data_age_s']:.0f}s, "
+          f"max data age {stats['max_data_age_s']:.0f}s, idle {stats['idle_s']:.0f}s "
+          f"(first road {stats['actuations'][0]['idle_s']:.0f}s)")
+
+
+def bench_controller(args):
+    """Cold start of the GUI vs the headless controller, and controller overhead per junction cycle"""
+    import subprocess
+    import sys
+
+    from junction_controller import JunctionController, Road, SignalStates
+    from signal_phases import TimerLoop
+
+    # Fresh interpreters, so nothing is cached in this process
+    for label, code in (("gui (import main)", "import main"),
+                        ("headless (controller CLI imports)",
+                         "import junction_controller, event_log, vehicle_detection")):
+        times = []
+        for _ in range(args.repeats):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", code], check=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            times.append(time.perf_counter() - start)
+        print(f"cold start {label}: {min(times) * 1000:.0f} ms")
+
+    # Instant measurements and 1 ms phases, so all that is left is the controller's own overhead
+    loop = TimerLoop()
+    roads = [Road(name, "stub") for name in ("North", "East", "South", "West")]
+    controller = JunctionController(roads, SignalStates(len(roads)), loop.after, loop.after_cancel,
+                                    mode="sequential", cycles=args.cycles, measure=lambda road: (0.001, False),
+                                    log=lambda message, **fields: None, on_complete=loop.stop, yellow_time=0.001,
+                                    all_red_time=0.001, poll_ms=1)
+    loop.after(0, controller.start)
+    loop.run()
+    overheads = sorted(c["overhead_s"] for c in controller.stats()["cycles"])
+    print(f"{args.cycles} cycles: controller overhead per cycle {sum(overheads) / len(overheads) * 1000:.2f} ms mean, "
+          f"{overheads[len(overheads) // 2] * 1000:.2f} ms median, {overheads[-1] * 1000:.2f} ms max")
+
+
+def _pss_mb(pid):
+    """Proportional set size of a process in MB: shared pages are split between the processes sharing them"""
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            if line.startswith("Pss:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def _junction_client(address, authkey, video, start, seconds, results, done):
+    """One junction sending its frames to the inference server one at a time, as fast as they are answered"""
+    import cv2
+    from inference_server import InferenceClient
+
+    client = InferenceClient(address, authkey)
+    cap = cv2.VideoCapture(video)
+    frames = [cv2.resize(cap.read()[1], (640, 480)) for _ in range(30)]
+    cap.release()
+    start.wait()
+    latencies = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        t0 = time.monotonic()
+        client.detect([frames[len(latencies) % len(frames)]])
+        latencies.append(time.monotonic() - t0)
+    results.put(latencies)
+    # Stay alive until memory has been measured
+    done.wait()
+    client.close()
+
+
+def _junction_standalone(model_path, ready, done):
+    """One junction with its own model, as before the shared server"""
+    import numpy as np
+    from vehicle_detection import VehicleDetector
+
+    detector = VehicleDetector(model_path=model_path)
+    detector.predict(np.zeros((480, 640, 3), dtype=np.uint8))
+    ready.set()
+    done.wait()
+
+
+def bench_server(args):
+    """Memory per junction and aggregate FPS with one shared inference server, 1 to 32 junctions"""
+    import multiprocessing
+
+    from inference_server import InferenceClient, start_server
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'junctions':>9} {'total MB':>9} {'MB/junction':>12} {'agg fps':>8} {'fps/junction':>13} "
+          f"{'p95 ms':>7} {'mean batch':>11}")
+    for junctions in args.junctions:
+        server = start_server(args.model, max_batch=args.max_batch, max_wait_ms=args.max_wait_ms)
+        start, done = context.Event(), context.Event()
+        results = context.Queue()
+        clients = [context.Process(target=_junction_client,
+                                   args=(server.address, server.authkey, args.video, start, args.seconds, results,
+                                         done))
+                   for _ in range(junctions)]
+        for client in clients:
+            client.start()
+        admin = InferenceClient(server.address, server.authkey)
+        # Let every client connect and decode its frames before the clock starts
+        while admin.stats()["clients"] < junctions + 1:
+            if any(client.exitcode is not None for client in clients):
+                raise RuntimeError("A junction client exited before the run started")
+            time.sleep(0.1)
+        time.sleep(1.0)
+        before = admin.stats()["frames"]
+        start.set()
+        time.sleep(args.seconds / 2)
+        memory = _pss_mb(server.pid) + sum(_pss_mb(client.pid) for client in clients)
+        latencies = sorted(latency for _ in clients for latency in results.get())
+        stats = admin.stats()
+        done.set()
+        for client in clients:
+            client.join()
+        admin.close()
+        server.shutdown()
+
+        fps = (stats["frames"] - before) / args.seconds
+        p95 = latencies[int(len(latencies) * 0.95)] * 1000 if latencies else 0.0
+        print(f"{junctions:>9} {memory:>9.0f} {memory / junctions:>12.0f} {fps:>8.1f} {fps / junctions:>13.2f} "
+              f"{p95:>7.0f} {stats['mean_batch']:>11.1f}")
+
+    # Baseline: a model per junction, as every DynamicSignalsApp loads today
+    for junctions in range(1, args.standalone_max + 1):
+        ready = [context.Event() for _ in range(junctions)]
+        done = context.Event()
+        processes = [context.Process(target=_junction_standalone, args=(args.model, event, done)) for event in ready]
+        for process in processes:
+            process.start()
+        for event in ready:
+            event.wait()
+        memory = sum(_pss_mb(process.pid) for process in processes)
+        done.set()
+        for process in processes:
+            process.join()
+        print(f"model per junction, {junctions} junctions: {memory:.0f} MB total, {memory / junctions:.0f} MB/junction")
+
+
+def _transfer_producer(channel, fps, count, results):
+    """Send count 640x480 frames at fps (0 for as fast as possible) through a FrameRing or multiprocessing queue"""
+    import resource
+
+    import numpy as np
+    from frame_ring import FrameRing
+
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 256, (480, 640, 3), dtype=np.uint8) for _ in range(8)]
+    ring = isinstance(channel, FrameRing)
+    sent = []
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.monotonic()
+    for i in range(count):
+        if fps:
+            delay = start + i / fps - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        sent.append(time.monotonic())
+        # The ring copy stands in for the decoder resizing straight into the slot
+        if ring:
+            channel.put(frames[i % len(frames)], i)
+        else:
+            channel.put((i, frames[i % len(frames)]))
+    if ring:
+        channel.close_writer()
+    else:
+        channel.put(None)
+    cpu = resource.getrusage(resource.RUSAGE_SELF)
+    results.put(("producer", sent, cpu.ru_utime + cpu.ru_stime - cpu_start.ru_utime - cpu_start.ru_stime))
+    if ring:
+        channel.close()
+
+
+def _transfer_consumer(channel, results):
+    import resource
+
+    from frame_ring import FrameRing
+
+    ring = isinstance(channel, FrameRing)
+    received = []
+    checksum = 0
+    cpu_start = resource.getrusage(resource.RUSAGE_SELF)
+    while True:
+        if ring:
+            sequence, frame = channel.get()
+            if sequence < 0:
+                break
+            checksum += int(frame[240, 320, 0])
+            channel.release()
+        else:
+            item = channel.get()
+            if item is None:
+                break
+            checksum += int(item[1][240, 320, 0])
+        received.append(time.monotonic())
+    cpu = resource.getrusage(resource.RUSAGE_SELF)
+    results.put(("consumer", received, cpu.ru_utime + cpu.ru_stime - cpu_start.ru_utime - cpu_start.ru_stime))
+    if ring:
+        channel.close()
+
+
+def bench_ring(args):
+    """Frame transfer between processes: shared-memory FrameRing vs pickling through a multiprocessing queue"""
+    import multiprocessing
+
+    from frame_ring import FrameRing
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'transport':>9} {'target':>7} {'fps':>7} {'mean ms':>8} {'p95 ms':>7} {'cpu ms/frame':>13} {'cpu %':>6}")
+    for fps in args.rates:
+        count = int(fps * args.seconds) if fps else args.frames
+        for transport in ("queue", "ring"):
+            channel = FrameRing(args.slots, context=context) if transport == "ring" else context.Queue(args.slots)
+            results = context.Queue()
+            processes = [context.Process(target=_transfer_consumer, args=(channel, results)),
+                         context.Process(target=_transfer_producer, args=(channel, fps, count, results))]
+            for process in processes:
+                process.start()
+            outcome = dict((side, (times, cpu)) for side, times, cpu in (results.get(), results.get()))
+            for process in processes:
+                process.join()
+            if transport == "ring":
+                channel.close()
+                channel.unlink()
+
+            sent, producer_cpu = outcome["producer"]
+            received, consumer_cpu = outcome["consumer"]
+            latencies = sorted(r - s for s, r in zip(sent, received))
+            elapsed = received[-1] - sent[0]
+            cpu = producer_cpu + consumer_cpu
+            print(f"{transport:>9} {fps or 'max':>7} {len(received) / elapsed:>7.1f} "
+                  f"{sum(latencies) / len(latencies) * 1000:>8.2f} {latencies[int(len(latencies) * 0.95)] * 1000:>7.2f} "
+                  f"{cpu / len(received) * 1000:>13.3f} {cpu / elapsed * 100:>6.1f}")
+
+
+def bench_sim(args):
+    """Simulated junction hours per wall-clock second, and the policy metrics it produces"""
+    import random
+
+    from junction_sim import JunctionSimulation, poisson_arrivals
+
+    names = ["North", "East", "South", "West"]
+    print(f"{args.hours:g} simulated hours, arrivals {args.rates} veh/h")
+    for policy in args.policies:
+        rng = random.Random(0)
+        simulation = JunctionSimulation(names, [poisson_arrivals(rate, rng) for rate in args.rates], policy)
+        r = simulation.run(args.hours * 3600.0)
+        events = r["arrived"] + r["departed"]
+        print(f"{policy:>12}: {r['wall_s']:.2f}s wall ({r['speedup']:,.0f}x real time, "
+              f"{events / r['wall_s']:,.0f} vehicle events/s), {r['throughput_per_hour']:.0f} veh/h, "
+              f"mean delay {r['mean_delay_s']:.1f}s (p95 {r['p95_delay_s']:.1f}s), mean queue {r['mean_queue']:.1f}, max queue {r['max_queue']}")
+
+
+def _redraw_signal(canvas, state):
+    """The old delete-and-redraw drawing of one signal head, as a baseline"""
+    canvas.delete("all")
+    canvas.create_rectangle(25, 25, 75, 175, fill="#333333", outline="black", width=2)
+    canvas.create_oval(35, 35, 65, 65, fill="#FF0000" if state == "red" else "#441111", outline="black")
+    canvas.create_oval(35, 85, 65, 115, fill="#FFFF00" if state == "yellow" else "#444411", outline="black")
+    canvas.create_oval(35, 135, 65, 165, fill="#00FF00" if state == "green" else "#114411", outline="black")
+    canvas.create_rectangle(25, 185, 75, 220, fill="#bbbbbb", outline="black")
+    canvas.create_line(50, 185, 50, 220, fill="white", width=2, dash=(5, 3))
+
+
+def bench_canvas(args):
+    """Junction-wide signal changes per second: delete-and-redraw vs retained canvas items (needs a display)"""
+    import tkinter
+    from signal_canvas import SignalBoard, SignalHead
+
+    root = tkinter.Tk()
+    columns = 16
+    canvases = []
+    for i in range(args.heads):
+        canvas = tkinter.Canvas(root, width=100, height=230, highlightthickness=0)
+        canvas.grid(row=i // columns, column=i % columns)
+        canvases.append(canvas)
+    root.update()
+
+    # Every change moves each head on to its next state, as a full junction change would
+    cycle = ["red", "green", "yellow"]
+    states = [[cycle[(i + n) % 3] for i in range(args.heads)] for n in range(args.changes)]
+
+    start = time.perf_counter()
+    for change in states:
+        for canvas, state in zip(canvases, change):
+            _redraw_signal(canvas, state)
+        root.update_idletasks()
+    redraw_time = time.perf_counter() - start
+
+    for canvas in canvases:
+        canvas.delete("all")
+    board = SignalBoard(root, [SignalHead(canvas) for canvas in canvases])
+    root.update()
+    start = time.perf_counter()
+    for change in states:
+        for index, state in enumerate(change):
+            board.set(index, state)
+        board.flush()
+        root.update_idletasks()
+    retained_time = time.perf_counter() - start
+    root.destroy()
+
+    print(f"{args.heads} signal heads, {args.changes} junction changes")
+    print(f"delete-and-redraw: {args.changes / redraw_time:8.1f} changes/s")
+    print(f"retained items:    {args.changes / retained_time:8.1f} changes/s "
+          f"({redraw_time / retained_time:.1f}x)")
+
+
+def bench_log(args):
+    """Cost of a log call to the caller and on-disk size with the JSON-lines file written in the background"""
+    import tempfile
+
+    from event_log import EventLog
+
+    with tempfile.TemporaryDirectory() as directory:
+        event_log = EventLog(os.path.join(directory, "events.jsonl"), max_bytes=1024 * 1024, backup_count=3)
+        start = time.perf_counter()
+        for i in range(args.events):
+            event_log.log("Green time computed", road="North", green_time=i % 60)
+        elapsed = time.perf_counter() - start
+        start = time.perf_counter()
+        event_log.close()
+        flush_time = time.perf_counter() - start
+        files = os.listdir(directory)
+        size = sum(os.path.getsize(os.path.join(directory, name)) for name in files)
+    print(f"{args.events} events: {elapsed / args.events * 1e6:.1f} us per call, {event_log.dropped} dropped, "
+          f"background flush {flush_time:.2f}s, {len(files)} files, {size / 1e6:.1f} MB on disk")
+
+
+def simulate_tracks(num_objects, frames, seed=0):
+    """Synthetic dense scene: yields (true_ids, rects) per frame for objects moving at constant velocity"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    # Keep density constant (about one vehicle per 40x40 px) as the count grows
+    side = max(int(np.sqrt(num_objects) * 40), 200)
+    positions = rng.uniform(0, side, (num_objects, 2))
+    velocities = rng.uniform(-6, 6, (num_objects, 2))
+    for _ in range(frames):
+        positions = (positions + velocities) % side
+        seen = rng.random(num_objects) > 0.05  # 5% missed detections
+        centres = positions[seen] + rng.normal(0, 1.5, (int(seen.sum()), 2))
+        rects = np.hstack([centres - 10, centres + 10]).astype(int)
+        yield np.flatnonzero(seen), rects
+
+
+def bench_tracker(args):
+    """Per-update time and ID switches for greedy vs gated optimal assignment"""
+    from centroid_tracker import CentroidTracker
+
+    modes = {
+        "greedy": dict(assignment="greedy"),
+        "optimal": dict(assignment="optimal", maxDistance=args.max_distance),
+    }
+    print(f"{'objects':>8} {'mode':>8} {'ms/update':>10} {'id switches':>12}")
+    for num_objects in args.objects:
+        for mode, options in modes.items():
+            ct = CentroidTracker(maxDisappeared=5, **options)
+            owner = {}  # true object -> tracker ID it was last matched to
+            switches = 0
+            elapsed = 0.0
+            for true_ids, rects in simulate_tracks(num_objects, args.frames):
+                start = time.perf_counter()
+                objects = ct.update(rects)
+                elapsed += time.perf_counter() - start
+
+                # Detections map back to tracker IDs through their centroids
+                centroids = ((rects[:, :2] + rects[:, 2:]) / 2.0).astype(int)
+                lookup = {tuple(c): objectID for objectID, c in objects.items()}
+                for true_id, centroid in zip(true_ids.tolist(), map(tuple, centroids)):
+                    objectID = lookup.get(centroid)
+                    if objectID is None:
+                        continue
+                    if true_id in owner and owner[true_id] != objectID:
+                        switches += 1
+                    owner[true_id] = objectID
+            print(f"{num_objects:>8} {mode:>8} {elapsed / args.frames * 1000:>10.2f} {switches:>12}")
+
+
+def bench_trace(args):
+    """Trace size, write time and replay speed on a synthetic scene, checked against direct tracking"""
+    import shutil
+    import tempfile
+
+    import numpy as np
+    from centroid_tracker import CentroidTracker
+    from detection_trace import DetectionTrace, replay_trace, write_trace
+
+    frames = [(rects, np.full(len(rects), 2), np.full(len(rects), 0.8))
+              for _, rects in simulate_tracks(args.objects, args.frames)]
+    ct = CentroidTracker()
+    start = time.perf_counter()
+    direct = [len(ct.update(rects)) for rects, _, _ in frames]
+    direct_time = time.perf_counter() - start
+
+    path = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        write_trace(path, frames)
+        write_time = time.perf_counter() - start
+        trace = DetectionTrace(path)
+        size = sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+        result = replay_trace(trace)
+    finally:
+        shutil.rmtree(path)
+
+    print(f"trace:  {trace.num_frames} frames, {trace.rows} detections, {size / 1e6:.2f} MB "
+          f"({size / max(trace.rows, 1):.1f} bytes/detection), written in {write_time:.2f}s")
+    print(f"direct: {args.frames / direct_time:,.0f} frames/s")
+    print(f"replay: {result['frames'] / result['elapsed_s']:,.0f} frames/s, "
+          f"peak {result['max_vehicles']}, green time {result['green_time']}s")
+    print(f"counts match direct tracking: {list(result['counts']) == direct}")
+
+
+def bench_kalman(args):
+    """ID switches and count error when detecting only every Nth frame, without and with Kalman prediction"""
+    import numpy as np
+    from centroid_tracker import CentroidTracker
+
+    frames = list(simulate_tracks(args.objects, args.frames))
+    print(f"{'every':>6} {'motion':>7} {'id switches':>12} {'count error':>12} {'ms/update':>10}")
+    for every in args.every:
+        for motion in ("none", "kalman"):
+            ct = CentroidTracker(maxDisappeared=max(1, 5 // every), maxDistance=args.max_distance,
+                                 motionModel=motion)
+            owner = {}
+            switches = 0
+            count_error = 0
+            elapsed = 0.0
+            for true_ids, rects in frames[::every]:
+                start = time.perf_counter()
+                objects = ct.update(rects, every)
+                elapsed += time.perf_counter() - start
+                count_error += abs(len(objects) - args.objects)
+
+                # Matched objects sit exactly on a detection only without prediction, so map
+                # each detection to the nearest tracked object instead
+                if not objects:
+                    continue
+                ids = np.fromiter(objects.keys(), dtype=int)
+                centres = np.array(list(objects.values()))
+                detected = (rects[:, :2] + rects[:, 2:]) / 2.0
+                nearest = ((detected[:, None, :] - centres[None, :, :]) ** 2).sum(axis=2).argmin(axis=1)
+                for true_id, objectID in zip(true_ids.tolist(), ids[nearest].tolist()):
+                    if true_id in owner and owner[true_id] != objectID:
+                        switches += 1
+                    owner[true_id] = objectID
+            updates = len(frames[::every])
+            print(f"{every:>6} {motion:>7} {switches:>12} {count_error / updates:>12.2f} "
+                  f"{elapsed / updates * 1000:>10.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--video", default=DEFAULT_VIDEO, help="video clip to benchmark on")
+    parser.add_argument("--model", default="yolov8n.pt", help="YOLOv8 weights")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    headless = subparsers.add_parser("headless", help="GUI vs headless detection")
+    headless.add_argument("--skip-gui", action="store_true", help="only time the headless path (no display)")
+    headless.set_defaults(func=bench_headless)
+
+    startup = subparsers.add_parser("startup", help="cold import, model load and first inference")
+    startup.set_defaults(func=bench_startup)
+
+    backend = subparsers.add_parser("backend", help="PyTorch vs exported inference backends")
+    backend.add_argument("--backends", nargs="+", default=["torch", "onnx", "openvino", "openvino-int8"],
+                         help="backends to compare; the first is the reference")
+    backend.set_defaults(func=bench_backend)
+
+    batch = subparsers.add_parser("batch", help="frames/sec per inference batch size")
+    batch.add_argument("--sizes", type=int, nargs="+", default=[1, 4, 8, 16], help="batch sizes to compare")
+    batch.set_defaults(func=bench_batch)
+
+    pipeline = subparsers.add_parser("pipeline", help="sequential vs threaded pipeline")
+    pipeline.add_argument("--queue-size", type=int, default=8, help="bounded queue size between stages")
+    pipeline.set_defaults(func=bench_pipeline)
+
+    parallel = subparsers.add_parser("parallel", help="sequential vs process-pool junction analysis")
+    parallel.add_argument("--videos", nargs=4, help="four approach videos (default: --video four times)")
+    parallel.add_argument("--torch-threads", type=int, help="torch threads per worker")
+    parallel.set_defaults(func=bench_parallel)
+
+    stride = subparsers.add_parser("stride", help="frame-stride sampling speedup vs peak count error")
+    stride.add_argument("--max-stride", type=int, default=8, help="upper bound for the adaptive stride")
+    stride.set_defaults(func=bench_stride)
+
+    early_exit = subparsers.add_parser("early-exit", help="analysis latency with early exit on convergence")
+    early_exit.add_argument("--windows", type=int, nargs="+", default=[30, 60, 150], help="stability windows")
+    early_exit.add_argument("--tolerance", type=float, default=0, help="allowed green time drift (s)")
+    early_exit.set_defaults(func=bench_early_exit)
+
+    roi = subparsers.add_parser("roi", help="whole-frame vs ROI-cropped inference")
+    roi.add_argument("--roi", default="100,250 560,250 630,479 20,479",
+                     help='ROI polygon as "x,y x,y x,y ..." in 640x480 pixels')
+    roi.set_defaults(func=bench_roi)
+
+    motion = subparsers.add_parser("motion", help="motion-gated inference: frames skipped and speedup")
+    motion.add_argument("--thresholds", type=float, nargs="+", default=[0.001, 0.002, 0.005, 0.01],
+                        help="fractions of changed pixels needed to run the model")
+    motion.set_defaults(func=bench_motion)
+
+    live = subparsers.add_parser("live", help="live ingestion latency and dropped frames")
+    live.add_argument("--seconds", type=float, default=20.0, help="how long to stream")
+    live.add_argument("--window", type=float, default=30.0, help="rolling window in seconds")
+    live.set_defaults(func=bench_live)
+
+    overlap = subparsers.add_parser("overlap", help="analyse-then-actuate vs overlapped junction control")
+    overlap.add_argument("--analysis-s", type=float, default=30.0, help="simulated analysis time per road (s)")
+    overlap.add_argument("--speed", type=float, default=20.0, help="run simulated time this much faster")
+    overlap.set_defaults(func=bench_overlap)
+
+    controller = subparsers.add_parser("controller", help="GUI vs headless cold start, controller overhead per cycle")
+    controller.add_argument("--repeats", type=int, default=5, help="cold starts to time (the best is shown)")
+    controller.add_argument("--cycles", type=int, default=200, help="junction cycles to time")
+    controller.set_defaults(func=bench_controller)
+
+    server = subparsers.add_parser("server", help="shared inference server: memory and FPS from 1 to 32 junctions")
+    server.add_argument("--junctions", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32],
+                        help="junction counts to run")
+    server.add_argument("--seconds", type=float, default=20.0, help="how long each run streams frames")
+    server.add_argument("--max-batch", type=int, default=16, help="most frames per model call")
+    server.add_argument("--max-wait-ms", type=float, default=10, help="batching latency budget")
+    server.add_argument("--standalone-max", type=int, default=4,
+                        help="largest model-per-junction baseline to load (each holds its own model)")
+    server.set_defaults(func=bench_server)
+
+    ring = subparsers.add_parser("ring", help="shared-memory frame ring vs queue transfer between processes")
+    ring.add_argument("--rates", type=float, nargs="+", default=[30, 60, 120, 0],
+                      help="frames per second to send (0 for as fast as possible)")
+    ring.add_argument("--seconds", type=float, default=10.0, help="how long each paced run lasts")
+    ring.add_argument("--frames", type=int, default=2000, help="frames for the unpaced run")
+    ring.add_argument("--slots", type=int, default=16, help="ring slots / queue capacity")
+    ring.set_defaults(func=bench_ring)
+
+    sim = subparsers.add_parser("sim", help="discrete-event junction simulation speed and policy metrics")
+    sim.add_argument("--hours", type=float, default=24.0, help="simulated hours of operation")
+    sim.add_argument("--rates", type=float, nargs=4, default=[300, 450, 200, 100],
+                     help="arrivals per hour on the four roads")
+    sim.add_argument("--policies", nargs="+", default=["sequential", "overlap", "fixed:20", "fixed:30"],
+                     help="signal policies to compare")
+    sim.set_defaults(func=bench_sim)
+
+    canvas = subparsers.add_parser("canvas", help="signal canvas redraw rate (needs a display)")
+    canvas.add_argument("--heads", type=int, default=64, help="signal heads on the dashboard")
+    canvas.add_argument("--changes", type=int, default=300, help="junction-wide state changes to time")
+    canvas.set_defaults(func=bench_canvas)
+
+    log = subparsers.add_parser("log", help="event log call cost and rotating file size")
+    log.add_argument("--events", type=int, default=100000, help="events to log")
+    log.set_defaults(func=bench_log)
+
+    tracker = subparsers.add_parser("tracker", help="tracker assignment scaling on synthetic scenes")
+    tracker.add_argument("--objects", type=int, nargs="+", default=[10, 50, 100, 500, 1000, 2000],
+                         help="simultaneous objects per scene")
+    tracker.add_argument("--frames", type=int, default=50, help="frames per scene")
+    tracker.add_argument("--max-distance", type=float, default=20.0, help="assignment gate in pixels")
+    tracker.set_defaults(func=bench_tracker)
+
+    kalman = subparsers.add_parser("kalman", help="tracking with the detector run every Nth frame")
+    kalman.add_argument("--objects", type=int, default=20, help="simultaneous objects per scene")
+    kalman.add_argument("--frames", type=int, default=600, help="video frames per scene")
+    kalman.add_argument("--every", type=int, nargs="+", default=[1, 2, 4, 8], help="detector frame intervals")
+    kalman.add_argument("--max-distance", type=float, default=30.0, help="assignment gate in pixels")
+    kalman.set_defaults(func=bench_kalman)
+
+    trace = subparsers.add_parser("trace", help="detection trace size and replay speed on a synthetic scene")
+    trace.add_argument("--objects", type=int, default=20, help="simultaneous objects per frame")
+    trace.add_argument("--frames", type=int, default=108000, help="frames (default: one hour at 30 fps)")
+    trace.set_defaults(func=bench_trace)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,73 +1,236 @@
 import numpy as np
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
 from scipy.spatial import distance as dist
 
 class CentroidTracker:
-    def __init__(self, maxDisappeared=50):
+    def __init__(self, maxDisappeared=50, capacity=64, maxDistance=None, assignment="greedy", motionModel="none",
+                 processNoise=1.0, measurementNoise=10.0):
+        if assignment not in ("greedy", "optimal"):
+            raise ValueError(f"Unknown assignment mode: {assignment}")
+        if motionModel not in ("none", "kalman"):
+            raise ValueError(f"Unknown motion model: {motionModel}")
         self.nextObjectID = 0
-        self.objects = {}
-        self.disappeared = {}
         self.maxDisappeared = maxDisappeared
+        # Objects and detections further apart than maxDistance (pixels) are never matched
+        self.maxDistance = maxDistance
+        # "greedy" matches by closest distance first; "optimal" solves the
+        # minimum total distance assignment over the gated candidate pairs
+        self.assignment = assignment
+        # "none" keeps each object at its last detected centroid; "kalman"
+        # keeps a constant-velocity Kalman filter per object, matches
+        # detections against predicted positions and coasts unmatched
+        # objects along their velocity
+        self.motionModel = motionModel
+        self.processNoise = processNoise  # Acceleration variance, (pixels / frame^2)^2
+        self.measurementNoise = measurementNoise  # Detected centroid variance, pixels^2
+
+        # Struct-of-arrays state. The first `count` slots hold the live
+        # objects in registration order; the arrays grow geometrically.
+        self.count = 0
+        self.objectIDs = np.empty(capacity, dtype=int)
+        self.centroids = np.empty((capacity, 2), dtype=int)
+        self.disappearedCounts = np.empty(capacity, dtype=int)
+        self._arrays = ("objectIDs", "centroids", "disappearedCounts")
+        if motionModel == "kalman":
+            # Filter state x, y, vx, vy (pixels, pixels / frame) and its covariance per object
+            self.states = np.empty((capacity, 4))
+            self.covariances = np.empty((capacity, 4, 4))
+            self._arrays += ("states", "covariances")
+
+    @property
+    def objects(self):
+        n = self.count
+        return dict(zip(self.objectIDs[:n].tolist(), self.centroids[:n].copy()))
+
+    @property
+    def disappeared(self):
+        n = self.count
+        return dict(zip(self.objectIDs[:n].tolist(), self.disappearedCounts[:n].tolist()))
+
+    def _reserve(self, extra):
+        needed = self.count + extra
+        capacity = len(self.objectIDs)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        n = self.count
+        for name in self._arrays:
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:n] = old[:n]
+            setattr(self, name, new)
 
     def register(self, centroid):
-        self.objects[self.nextObjectID] = centroid
-        self.disappeared[self.nextObjectID] = 0
-        self.nextObjectID += 1
+        self.registerMany(np.asarray(centroid).reshape(1, 2))
+
+    def registerMany(self, centroids):
+        k = len(centroids)
+        self._reserve(k)
+        n = self.count
+        self.objectIDs[n:n + k] = np.arange(self.nextObjectID, self.nextObjectID + k)
+        self.centroids[n:n + k] = centroids
+        self.disappearedCounts[n:n + k] = 0
+        if self.motionModel == "kalman":
+            # Start at rest, with the velocity uncertain
+            self.states[n:n + k, :2] = centroids
+            self.states[n:n + k, 2:] = 0.0
+            self.covariances[n:n + k] = np.diag([self.measurementNoise] * 2 + [100.0] * 2)
+        self.nextObjectID += k
+        self.count += k
+
+    def _compact(self, keep):
+        # Drop slots where keep is False, preserving registration order
+        n = self.count
+        k = int(keep.sum())
+        if k == n:
+            return
+        for name in self._arrays:
+            array = getattr(self, name)
+            array[:k] = array[:n][keep]
+        self.count = k
 
     def deregister(self, objectID):
-        del self.objects[objectID]
-        del self.disappeared[objectID]
-
-    def update(self, rects):
+        self._compact(self.objectIDs[:self.count] != objectID)
+
+    def predict(self, dt=1):
+        """Advance every object's Kalman state by dt frames without a detection
+
+        Use on frames the detector is not run on; update() predicts by
+        itself. Returns the predicted objects. Does nothing without the
+        "kalman" motion model.
+        """
+        if self.motionModel == "kalman":
+            self._predict(dt)
+        return self.objects
+
+    def _predict(self, dt):
+        n = self.count
+        if n == 0:
+            return
+        F = np.array([[1, 0, dt, 0], [0, 1, 0, dt], [0, 0, 1, 0], [0, 0, 0, 1]], dtype=float)
+        # Constant-velocity model driven by white-noise acceleration
+        q = self.processNoise * np.array([[dt ** 3 / 3, dt ** 2 / 2], [dt ** 2 / 2, dt]])
+        Q = np.zeros((4, 4))
+        Q[np.ix_([0, 2], [0, 2])] = q
+        Q[np.ix_([1, 3], [1, 3])] = q
+
+        states = self.states[:n]
+        states[:, :2] += dt * states[:, 2:]
+        self.covariances[:n] = F @ self.covariances[:n] @ F.T + Q
+        self.centroids[:n] = np.rint(states[:, :2])
+
+    def _correct(self, rows, measured):
+        """Kalman measurement update of objects rows with their detected centroids"""
+        P = self.covariances[rows]
+        # Only the position is measured, so H P is the first two rows of P
+        S = P[:, :2, :2] + self.measurementNoise * np.eye(2)
+        K = P[:, :, :2] @ np.linalg.inv(S)
+        innovation = measured - self.states[rows, :2]
+        self.states[rows] += (K @ innovation[:, :, None])[:, :, 0]
+        self.covariances[rows] = P - K @ P[:, :2, :]
+        self.centroids[rows] = np.rint(self.states[rows, :2])
+
+    def _matchGreedy(self, inputCentroids):
+        D = dist.cdist(self.centroids[:self.count], inputCentroids)
+
+        rows = D.min(axis=1).argsort()
+        cols = D.argmin(axis=1)[rows]
+        if self.maxDistance is not None:
+            inGate = D[rows, cols] <= self.maxDistance
+            rows, cols = rows[inGate], cols[inGate]
+
+        # Greedy matching in order of closest distance: each row is unique,
+        # so a row matches iff it is the first to claim its column
+        _, first = np.unique(cols, return_index=True)
+        return rows[first], cols[first]
+
+    def _matchOptimal(self, inputCentroids):
+        n, m = self.count, len(inputCentroids)
+        if self.maxDistance is None:
+            return linear_sum_assignment(dist.cdist(self.centroids[:n], inputCentroids))
+
+        # Candidate pairs within the gate from a KD-tree search, so memory
+        # grows with the number of nearby pairs rather than n * m
+        pairs = cKDTree(self.centroids[:n]).sparse_distance_matrix(
+            cKDTree(inputCentroids), self.maxDistance, output_type="ndarray")
+        if len(pairs) == 0:
+            return np.empty(0, dtype=int), np.empty(0, dtype=int)
+        rows, cols, cost = pairs["i"], pairs["j"], pairs["v"]
+
+        # Independent clusters of the bipartite candidate graph can be solved separately
+        graph = coo_matrix((np.ones(len(rows)), (rows, cols + n)), shape=(n + m, n + m))
+        _, labels = connected_components(graph, directed=False)
+        component = labels[rows]
+        order = np.argsort(component, kind="stable")
+        rows, cols, cost, component = rows[order], cols[order], cost[order], component[order]
+        bounds = np.flatnonzero(np.diff(component)) + 1
+        starts = np.r_[0, bounds]
+        ends = np.r_[bounds, len(rows)]
+
+        # Clusters with a single candidate pair match directly
+        single = (ends - starts) == 1
+        usedRows = [rows[starts[single]]]
+        usedCols = [cols[starts[single]]]
+
+        for start, end in zip(starts[~single], ends[~single]):
+            clusterRows, r = np.unique(rows[start:end], return_inverse=True)
+            clusterCols, c = np.unique(cols[start:end], return_inverse=True)
+            # Pairs outside the gate cost more than any set of gated pairs,
+            # so the solver maximises the number of matches first
+            penalty = (self.maxDistance + 1.0) * (len(clusterRows) + len(clusterCols))
+            C = np.full((len(clusterRows), len(clusterCols)), penalty)
+            C[r, c] = cost[start:end]
+            a, b = linear_sum_assignment(C)
+            inGate = C[a, b] <= self.maxDistance
+            usedRows.append(clusterRows[a[inGate]])
+            usedCols.append(clusterCols[b[inGate]])
+
+        return np.concatenate(usedRows), np.concatenate(usedCols)
+
+    def update(self, rects, dt=1):
+        """Match this frame's (x1, y1, x2, y2) boxes to the tracked objects
+
+        dt is the number of video frames since the previous update, so the
+        Kalman motion model can predict across frames the detector skipped.
+        Returns {objectID: centroid}.
+        """
+        if self.motionModel == "kalman":
+            self._predict(dt)
+        n = self.count
         if len(rects) == 0:
-            for objectID in list(self.disappeared.keys()):
-                self.disappeared[objectID] += 1
-                if self.disappeared[objectID] > self.maxDisappeared:
-                    self.deregister(objectID)
+            self.disappearedCounts[:n] += 1
+            self._compact(self.disappearedCounts[:n] <= self.maxDisappeared)
             return self.objects
 
-        inputCentroids = np.zeros((len(rects), 2), dtype="int")
+        rects = np.asarray(rects).reshape(-1, 4)
+        inputCentroids = ((rects[:, :2] + rects[:, 2:]) / 2.0).astype(int)
 
-        for (i, (startX, startY, endX, endY)) in enumerate(rects):
-            cX = int((startX + endX) / 2.0)
-            cY = int((startY + endY) / 2.0)
-            inputCentroids[i] = (cX, cY)
+        if n == 0:
+            self.registerMany(inputCentroids)
+            return self.objects
 
-        if len(self.objects) == 0:
-            for i in range(0, len(inputCentroids)):
-                self.register(inputCentroids[i])
+        if self.assignment == "optimal":
+            usedRows, usedCols = self._matchOptimal(inputCentroids)
         else:
-            objectIDs = list(self.objects.keys())
-            objectCentroids = list(self.objects.values())
-
-            D = dist.cdist(np.array(objectCentroids), inputCentroids)
-
-            rows = D.min(axis=1).argsort()
-            cols = D.argmin(axis=1)[rows]
-
-            usedRows = set()
-            usedCols = set()
+            usedRows, usedCols = self._matchGreedy(inputCentroids)
 
-            for (row, col) in zip(rows, cols):
-                if row in usedRows or col in usedCols:
-                    continue
-
-                objectID = objectIDs[row]
-                self.objects[objectID] = inputCentroids[col]
-                self.disappeared[objectID] = 0
-
-                usedRows.add(row)
-                usedCols.add(col)
-
-            unusedRows = set(range(0, D.shape[0])).difference(usedRows)
-            unusedCols = set(range(0, D.shape[1])).difference(usedCols)
+        if self.motionModel == "kalman":
+            self._correct(usedRows, inputCentroids[usedCols])
+        else:
+            self.centroids[usedRows] = inputCentroids[usedCols]
+        unusedRows = np.ones(n, dtype=bool)
+        unusedRows[usedRows] = False
+        self.disappearedCounts[:n][unusedRows] += 1
+        self.disappearedCounts[usedRows] = 0
 
-            for row in unusedRows:
-                objectID = objectIDs[row]
-                self.disappeared[objectID] += 1
-                if self.disappeared[objectID] > self.maxDisappeared:
-                    self.deregister(objectID)
+        unusedCols = np.ones(len(inputCentroids), dtype=bool)
+        unusedCols[usedCols] = False
 
-            for col in unusedCols:
-                self.register(inputCentroids[col])
+        self._compact(self.disappearedCounts[:n] <= self.maxDisappeared)
+        self.registerMany(inputCentroids[unusedCols])
 
-        return self.objects
\ No newline at end of file
+        return self.objects
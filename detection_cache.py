@@ -0,0 +1,117 @@
+import hashlib
+import os
+import tempfile
+
+import numpy as np
+
+from model_backends import file_hash
+
+DEFAULT_CACHE_DIR = ".detection_cache"
+
+
+class DetectionCache:
+    """On-disk cache of the filtered per-frame detections of whole videos
+
+    Entries are keyed by the video's content hash plus everything that
+    changes the detections (model, input size, confidence threshold,
+    classes and region of interest), so re-analysing the same recording skips inference and
+    only replays tracking. The cache is bounded to max_bytes; the least
+    recently used entries are evicted first.
+    """
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0  # Video bytes that did not need decoding or inference
+        # Content hashes by (path, size, mtime), so a file is only hashed once per process
+        self._video_hashes = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def video_hash(self, video_path):
+        stat = os.stat(video_path)
+        memo_key = (os.path.abspath(video_path), stat.st_size, stat.st_mtime_ns)
+        if memo_key not in self._video_hashes:
+            self._video_hashes[memo_key] = file_hash(video_path)
+        return self._video_hashes[memo_key]
+
+    def key(self, video_path, model_id, imgsz, conf_threshold, classes, roi=None):
+        """Cache key for one video analysed with the given detector settings and optional ROI polygon text"""
+        parts = [self.video_hash(video_path), model_id, f"{imgsz[0]}x{imgsz[1]}", repr(float(conf_threshold)),
+                 ",".join(sorted(classes))]
+        if roi is not None:
+            parts.append(roi)
+        return hashlib.sha256("|".join(parts).encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npz")
+
+    def get(self, key, video_path=None):
+        """Per-frame detections stored under key, or None on a miss
+
+        Returns a list of (rects, class_ids, confidences) per frame.
+        """
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                offsets = data["offsets"]
+                boxes = data["boxes"].astype(int)
+                class_ids = data["class_ids"].astype(int)
+                confs = data["confs"]
+        except (OSError, KeyError, ValueError):
+            self.misses += 1
+            return None
+
+        # Mark as recently used for LRU eviction
+        os.utime(path)
+        self.hits += 1
+        if video_path is not None:
+            self.bytes_saved += os.path.getsize(video_path)
+        if len(offsets) < 2:
+            return []
+        bounds = offsets[1:-1]
+        return list(zip(np.split(boxes, bounds), np.split(class_ids, bounds), np.split(confs, bounds)))
+
+    def put(self, key, frames):
+        """Store per-frame (rects, class_ids, confidences) under key, then evict down to max_bytes"""
+        counts = [len(rects) for rects, _, _ in frames]
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        if frames:
+            boxes = np.concatenate([np.asarray(rects).reshape(-1, 4) for rects, _, _ in frames])
+            class_ids = np.concatenate([class_ids for _, class_ids, _ in frames])
+            confs = np.concatenate([confs for _, _, confs in frames])
+        else:
+            boxes, class_ids, confs = np.empty((0, 4)), np.empty(0), np.empty(0)
+
+        # Write to a temporary file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.savez(f, offsets=offsets, boxes=boxes.astype(np.int32), class_ids=class_ids.astype(np.int16),
+                     confs=confs.astype(np.float32))
+        os.replace(tmp_path, self._path(key))
+        self._evict(keep=self._path(key))
+
+    def _evict(self, keep=None):
+        """Delete least recently used entries until the cache fits in max_bytes, never the entry at keep
+
+        The entry just written is kept even if its mtime ties an older
+        one's or it alone is over the budget.
+        """
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".npz"):
+                path = os.path.join(self.cache_dir, name)
+                stat = os.stat(path)
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            os.remove(path)
+            total -= size
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "bytes_saved": self.bytes_saved}
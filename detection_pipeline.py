@@ -0,0 +1,325 @@
+import queue
+import threading
+import time
+import traceback
+
+import cv2
+
+from vehicle_detection import NO_DETECTIONS, calculate_green_time
+
+# Marks the end of the stream on a stage's output queue
+_END = object()
+
+
+class StageError(RuntimeError):
+    """Cause attached to a stage's exception when run() re-raises it; its message is the stage's traceback"""
+
+
+def _drop_tracebacks(error):
+    """Release the frames held by the tracebacks of error and the exceptions chained to it"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        error.__traceback__ = None
+        error = error.__cause__ or error.__context__
+
+
+class StageStats:
+    """Counters for one pipeline stage"""
+
+    def __init__(self, name, out_queue=None):
+        self.name = name
+        self.out_queue = out_queue
+        self.items = 0
+        self.skipped = 0
+        self.busy_time = 0.0
+        self.max_depth = 0
+
+    def as_dict(self, elapsed):
+        depth = self.out_queue.qsize() if self.out_queue is not None else 0
+        return {
+            "items": self.items,
+            "skipped": self.skipped,
+            "busy_s": self.busy_time,
+            "items_per_s": self.items / elapsed if elapsed > 0 else 0.0,
+            "utilisation": self.busy_time / elapsed if elapsed > 0 else 0.0,
+            "queue_depth": depth,
+            "max_queue_depth": self.max_depth,
+        }
+
+
+class DetectionPipeline:
+    """Threaded decode -> infer -> track -> render pipeline for one video
+
+    Each stage runs on its own thread and hands work to the next through a
+    bounded queue, so decoding and rendering overlap with inference and a
+    slow stage applies backpressure instead of buffering frames without
+    limit. Pressing 'q' or closing the render window stops every stage.
+
+    With decode_process, decoding runs in a separate process that resizes
+    frames straight into a shared-memory FrameRing, so it doesn't compete
+    with inference for the GIL and no frame is pickled or copied on the
+    way; the last stage to use a frame hands its slot back.
+    """
+
+    def __init__(self, detector, video_path, display=True, queue_size=8, batch_size=None, record=False,
+                 roi=None, motion_gate=None, decode_process=False):
+        self.detector = detector
+        self.video_path = video_path
+        self.roi = roi  # Optional RegionOfInterest, see VehicleDetector.predict
+        self.motion_gate = motion_gate  # Optional MotionGate; skipped frames reuse the last detections
+        self.display = display
+        self.batch_size = batch_size or detector.batch_size
+        self.decode_process = decode_process
+        self.ring = None  # FrameRing and decoder process while running with decode_process
+        self.decoder = None
+        self.window_name = "Traffic Detection"
+
+        self.frame_queue = queue.Queue(maxsize=queue_size)
+        self.detection_queue = queue.Queue(maxsize=queue_size)
+        self.render_queue = queue.Queue(maxsize=queue_size) if display else None
+        self.stop_event = threading.Event()
+
+        self.stage_stats = {
+            "decode": StageStats("decode", self.frame_queue),
+            "infer": StageStats("infer", self.detection_queue),
+            "track": StageStats("track", self.render_queue),
+        }
+        if display:
+            self.stage_stats["render"] = StageStats("render")
+
+        self.cumulative_count = 0
+        self.emergency_detected = False
+        # Per-frame (rects, class_ids, confidences) when recording, e.g. for the detection cache
+        self.recorded = [] if record else None
+        self.errors = []
+        self.start_time = None
+        self.end_time = None
+
+    def stop(self):
+        """Ask every stage to finish; safe to call from any thread"""
+        self.stop_event.set()
+
+    def stats(self):
+        """Per-stage throughput and queue depth; can be polled while running"""
+        if self.start_time is None:
+            return {}
+        elapsed = (self.end_time or time.perf_counter()) - self.start_time
+        return {name: stage.as_dict(elapsed) for name, stage in self.stage_stats.items()}
+
+    def _put(self, q, item, stats):
+        # Block while the next stage is behind, but keep checking for a stop request
+        while not self.stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                stats.max_depth = max(stats.max_depth, q.qsize())
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self.stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _run_stage(self, target, out_queue):
+        try:
+            target()
+        except Exception as e:
+            # Keep the stage's traceback as text only: its frames hold locals such
+            # as views into the shared-memory ring, which must go before it closes
+            self.errors.append((e, traceback.format_exc()))
+            _drop_tracebacks(e)
+            self.stop_event.set()
+        finally:
+            # Pass the end marker on so downstream stages drain and exit;
+            # after a stop request they exit on their own
+            if out_queue is not None:
+                self._put(out_queue, _END, StageStats("end"))
+
+    def _decode(self):
+        stats = self.stage_stats["decode"]
+        cap = cv2.VideoCapture(self.video_path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video file: {self.video_path}")
+        try:
+            while not self.stop_event.is_set():
+                start = time.perf_counter()
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                frame_resized = cv2.resize(frame, (640, 480))
+                stats.busy_time += time.perf_counter() - start
+                stats.items += 1
+                if not self._put(self.frame_queue, frame_resized, stats):
+                    break
+        finally:
+            cap.release()
+
+    def _receive(self):
+        """Decode stage for decode_process: pass on frames the decoder process publishes in the ring"""
+        stats = self.stage_stats["decode"]
+        while not self.stop_event.is_set():
+            item = self.ring.get(timeout=0.1)
+            if item is None:
+                if self.decoder.is_alive():
+                    continue
+                # The decoder may have published its last slot just before exiting
+                item = self.ring.get(timeout=0)
+                if item is None:
+                    raise RuntimeError(f"Decoder process exited with code {self.decoder.exitcode}")
+            sequence, frame = item
+            if sequence == self.ring.END:
+                break
+            if sequence == self.ring.ERROR:
+                raise ValueError(f"Could not open video file: {self.video_path}")
+            stats.items += 1
+            if not self._put(self.frame_queue, frame, stats):
+                break
+
+    def _frame_done(self):
+        """Called once per frame by the last stage that uses it"""
+        if self.ring is not None:
+            self.ring.release()
+
+    def _infer(self):
+        stats = self.stage_stats["infer"]
+        last = NO_DETECTIONS
+        finished = False
+        while not finished:
+            frame = self._get(self.frame_queue)
+            if frame is _END:
+                break
+            # Batch whatever is already decoded, up to batch_size frames
+            batch = [frame]
+            while len(batch) < self.batch_size:
+                try:
+                    frame = self.frame_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if frame is _END:
+                    finished = True
+                    break
+                batch.append(frame)
+
+            start = time.perf_counter()
+            detections, needed = self.detector._detect_batch(batch, self.roi, self.motion_gate, last)
+            last = detections[-1]
+            stats.busy_time += time.perf_counter() - start
+            stats.items += len(batch)
+            stats.skipped += len(batch) - sum(needed)
+
+            for frame, detection in zip(batch, detections):
+                if not self._put(self.detection_queue, (frame, detection), stats):
+                    return
+
+    def _track(self):
+        stats = self.stage_stats["track"]
+        ct = self.detector._new_tracker()
+        while True:
+            item = self._get(self.detection_queue)
+            if item is _END:
+                break
+            frame, (rects, class_ids, confs, emergency) = item
+
+            start = time.perf_counter()
+            objects = ct.update(rects)
+            if self.recorded is not None:
+                self.recorded.append((rects, class_ids, confs))
+            self.cumulative_count = max(self.cumulative_count, len(objects))
+            self.emergency_detected = self.emergency_detected or emergency
+            stats.busy_time += time.perf_counter() - start
+            stats.items += 1
+
+            if not self.display:
+                self._frame_done()
+            else:
+                item = (frame, rects, class_ids, confs, objects, self.cumulative_count, self.emergency_detected)
+                if not self._put(self.render_queue, item, stats):
+                    break
+
+    def _render(self):
+        stats = self.stage_stats["render"]
+        cv2.namedWindow(self.window_name, cv2.WINDOW_NORMAL)
+        try:
+            while True:
+                item = self._get(self.render_queue)
+                if item is _END:
+                    break
+                start = time.perf_counter()
+                frame = item[0]
+                self.detector._draw_frame(*item, roi=self.roi)
+                cv2.imshow(self.window_name, frame)
+                key = cv2.waitKey(1) & 0xFF
+                self._frame_done()
+                stats.busy_time += time.perf_counter() - start
+                stats.items += 1
+
+                # 'q' or a closed window stops the whole pipeline
+                if key == ord('q') or cv2.getWindowProperty(self.window_name, cv2.WND_PROP_VISIBLE) < 1:
+                    self.stop()
+                    break
+        finally:
+            cv2.destroyWindow(self.window_name)
+
+    def _close_ring(self):
+        self.ring.stop()
+        self.decoder.join()
+        # Frames left in the queues after a stop are views into the ring
+        for q in (self.frame_queue, self.detection_queue, self.render_queue):
+            while q is not None and not q.empty():
+                q.get_nowait()
+        try:
+            self.ring.close()
+        except BufferError:
+            # A view into the ring is still referenced; the memory goes once it does
+            pass
+        finally:
+            self.ring.unlink()
+            self.ring = None
+
+    def run(self):
+        """Run the pipeline to completion and return (green_time, emergency_detected)
+
+        Rendering runs on the calling thread, which is where OpenCV's
+        HighGUI expects its window calls to happen.
+        """
+        self.start_time = time.perf_counter()
+        decode = self._decode
+        if self.decode_process:
+            import multiprocessing
+            from frame_ring import FrameRing, decode_into
+            # Enough slots for every frame the queues and a batch can hold at once
+            self.ring = FrameRing(slots=4 * self.frame_queue.maxsize + self.batch_size)
+            self.decoder = multiprocessing.get_context("spawn").Process(
+                target=decode_into, args=(self.ring, self.video_path), name="decoder")
+            self.decoder.daemon = True
+            self.decoder.start()
+            decode = self._receive
+        stages = [(decode, self.frame_queue), (self._infer, self.detection_queue),
+                  (self._track, self.render_queue)]
+        threads = []
+        for target, out_queue in stages:
+            thread = threading.Thread(target=self._run_stage, args=(target, out_queue))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        try:
+            if self.display:
+                self._run_stage(self._render, None)
+        finally:
+            for thread in threads:
+                thread.join()
+            self.end_time = time.perf_counter()
+            if self.ring is not None:
+                self._close_ring()
+
+        if self.errors:
+            error, stage_traceback = self.errors[0]
+            raise error from StageError(stage_traceback)
+        return calculate_green_time(self.cumulative_count), self.emergency_detected
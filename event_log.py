@@ -0,0 +1,187 @@
+"""Thread-safe event log: bounded on-screen view plus a rotating JSON-lines file
+
+Any thread logs through the standard logging module. Records go through
+a bounded queue to a background listener that writes them to a rotating
+JSON-lines file, and into a bounded buffer that the Tk view drains in
+batches on a timer, so neither the UI thread nor the workers ever block
+on the log and memory stays flat over a long shift.
+"""
+import collections
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+
+LOGGER_NAME = "dynamic_signals"
+DEFAULT_LOG_FILE = os.path.join("logs", "events.jsonl")
+
+_instances = itertools.count()
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """One JSON object per record: time, level, message and any structured fields"""
+
+    def format(self, record):
+        event = {
+            "time": self.formatTime(record, "%Y-%m-%dT%H:%M:%S") + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        event.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            event["exception"] = self.formatException(record.exc_info)
+        return json.dumps(event, default=str)
+
+
+class BoundedQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking or erroring when the queue is full
+
+    Drops are not silent: once the queue has room again, an "N events
+    dropped" warning goes ahead of the next record, and flush_dropped()
+    writes any still unreported at shutdown.
+    """
+
+    def __init__(self, maxsize=10000, logger_name=LOGGER_NAME):
+        super().__init__(queue.Queue(maxsize))
+        self.logger_name = logger_name
+        self.dropped = 0
+        self.unreported = 0
+
+    def _dropped_record(self, count):
+        record = logging.LogRecord(self.logger_name, logging.WARNING, __file__, 0, f"{count} events dropped",
+                                   None, None)
+        record.fields = {"dropped": count}
+        return record
+
+    def enqueue(self, record):
+        # Called under the handler's lock (taken by handle()), which flush_dropped() also takes
+        with self.lock:
+            try:
+                if self.unreported:
+                    self.queue.put_nowait(self._dropped_record(self.unreported))
+                    self.unreported = 0
+                self.queue.put_nowait(record)
+            except queue.Full:
+                self.dropped += 1
+                self.unreported += 1
+
+    def flush_dropped(self):
+        """Queue the report of drops not yet reported, waiting for room (the listener must be running)"""
+        with self.lock:
+            if self.unreported:
+                self.queue.put(self._dropped_record(self.unreported))
+                self.unreported = 0
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        # The queue may be full; the listener is still draining it, so wait for room
+        self.queue.put(self._sentinel)
+
+
+class TextLogView(logging.Handler):
+    """Shows log records in a Tk Text widget, keeping at most max_lines lines
+
+    emit() may be called from any thread and only appends to a bounded
+    buffer; the widget is updated on the Tk thread every interval_ms with
+    everything buffered since the last update, in one insert, one trim
+    and one scroll.
+    """
+
+    def __init__(self, text, max_lines=1000, interval_ms=100):
+        super().__init__()
+        self.text = text
+        self.max_lines = max_lines
+        self.interval_ms = interval_ms
+        # Lines the view could never show are dropped before they reach the widget
+        self.pending = collections.deque(maxlen=max_lines)
+        self.pending_lock = threading.Lock()
+        self.lines = 0
+        self.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%H:%M:%S"))
+        self.after_id = self.text.after(self.interval_ms, self.drain)
+
+    def emit(self, record):
+        try:
+            line = self.format(record)
+        except Exception:
+            self.handleError(record)
+            return
+        with self.pending_lock:
+            self.pending.append(line)
+
+    def drain(self):
+        with self.pending_lock:
+            lines = list(self.pending)
+            self.pending.clear()
+        if lines:
+            self.text.insert("end", "\n".join(lines) + "\n")
+            self.lines += len(lines)
+            excess = self.lines - self.max_lines
+            if excess > 0:
+                self.text.delete("1.0", f"{excess + 1}.0")
+                self.lines -= excess
+            self.text.see("end")
+        self.after_id = self.text.after(self.interval_ms, self.drain)
+
+    def clear(self):
+        with self.pending_lock:
+            self.pending.clear()
+        self.text.delete("1.0", "end")
+        self.lines = 0
+
+    def close(self):
+        if self.after_id is not None:
+            self.text.after_cancel(self.after_id)
+            self.after_id = None
+        super().close()
+
+
+class EventLog:
+    """Logger whose records go to a rotating JSON-lines file on a background thread and to extra handlers
+
+    log(message, **fields) records a structured event; fields end up as
+    keys of its JSON line. Call close() on shutdown to flush the file.
+    """
+
+    def __init__(self, path=DEFAULT_LOG_FILE, max_bytes=5 * 1024 * 1024, backup_count=5, queue_size=10000,
+                 handlers=()):
+        # A child logger per instance, so two logs in one process don't each get the other's records
+        self.logger = logging.getLogger(f"{LOGGER_NAME}.{next(_instances)}")
+        self.logger.setLevel(logging.INFO)
+        self.logger.propagate = False
+
+        sinks = list(handlers)
+        if path is not None:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count,
+                                                                encoding="utf-8")
+            file_handler.setFormatter(JsonLinesFormatter())
+            sinks.append(file_handler)
+        self.queue_handler = BoundedQueueHandler(queue_size, self.logger.name)
+        self.listener = _QueueListener(self.queue_handler.queue, *sinks, respect_handler_level=True)
+        self.logger.addHandler(self.queue_handler)
+        self.listener.start()
+
+    def add_handler(self, handler):
+        """Send records to handler directly from the logging thread (it must be cheap and thread-safe)"""
+        self.logger.addHandler(handler)
+
+    def log(self, message, level=logging.INFO, **fields):
+        self.logger.log(level, message, extra={"fields": fields})
+
+    @property
+    def dropped(self):
+        return self.queue_handler.dropped
+
+    def close(self):
+        self.queue_handler.flush_dropped()
+        self.listener.stop()
+        for handler in list(self.logger.handlers):
+            self.logger.removeHandler(handler)
+            handler.close()
+        for handler in self.listener.handlers:
+            handler.close()
+
@@ -0,0 +1,152 @@
+"""Shared-memory ring buffer for passing decoded frames between processes without copying"""
+import multiprocessing
+from multiprocessing import shared_memory
+
+import cv2
+import numpy as np
+
+
+class FrameRing:
+    """Fixed number of frame slots in shared memory, filled by one writer process and read by one reader
+
+    The writer reserves the next free slot, fills it in place (e.g. as the
+    dst of cv2.resize) and publishes it with a sequence number; the reader
+    gets NumPy views of published slots in order and hands each back with
+    release() once it is done with the frame, oldest first. Two semaphores
+    count the free and published slots, so the writer blocks while every
+    slot is still in use and the reader while none is ready. Frames are
+    written once into shared memory and never pickled or copied between
+    the processes.
+
+    Pass the ring to the other process as a multiprocessing.Process
+    argument; the unpickled copy attaches to the same shared memory. The
+    creating process should unlink() it once both sides have closed.
+    """
+
+    END = -1  # Sequence number marking the end of the stream
+    ERROR = -2  # Sequence number marking a writer that failed
+
+    def __init__(self, slots=16, shape=(480, 640, 3), dtype=np.uint8, context=None):
+        context = context or multiprocessing.get_context("spawn")
+        self.num_slots = slots
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        # Header of one int64 sequence number per slot, then the frames
+        self.shm = shared_memory.SharedMemory(create=True, size=8 * slots + frame_bytes * slots)
+        self.free = context.Semaphore(slots)
+        self.filled = context.Semaphore(0)
+        self.stopped = context.Event()
+        self._attach()
+
+    def __getstate__(self):
+        return {"name": self.shm.name, "num_slots": self.num_slots, "shape": self.shape, "dtype": self.dtype.str,
+                "free": self.free, "filled": self.filled, "stopped": self.stopped}
+
+    def __setstate__(self, state):
+        self.num_slots = state["num_slots"]
+        self.shape = state["shape"]
+        self.dtype = np.dtype(state["dtype"])
+        self.free = state["free"]
+        self.filled = state["filled"]
+        self.stopped = state["stopped"]
+        self.shm = shared_memory.SharedMemory(name=state["name"])
+        self._attach()
+
+    def _attach(self):
+        self.sequences = np.ndarray((self.num_slots,), np.int64, self.shm.buf)
+        self.frames = np.ndarray((self.num_slots,) + self.shape, self.dtype, self.shm.buf, offset=8 * self.num_slots)
+        # Positions are per process: only the writer moves write_pos, only the reader read_pos
+        self.write_pos = 0
+        self.read_pos = 0
+
+    def reserve(self, timeout=None):
+        """Writer: view of the next free slot to fill in place, or None once the reader has stopped
+
+        Call publish() when the slot is filled. Waits up to timeout
+        seconds (for ever with None) and returns None if no slot is freed.
+        """
+        waited = 0.0
+        while not self.stopped.is_set():
+            if self.free.acquire(timeout=0.1):
+                return self.frames[self.write_pos % self.num_slots]
+            waited += 0.1
+            if timeout is not None and waited >= timeout:
+                return None
+        return None
+
+    def publish(self, sequence):
+        """Writer: hand the reserved slot to the reader, tagged with sequence"""
+        self.sequences[self.write_pos % self.num_slots] = sequence
+        self.write_pos += 1
+        self.filled.release()
+
+    def put(self, frame, sequence, timeout=None):
+        """Writer: copy frame into the next free slot and publish it; False if the reader has stopped"""
+        slot = self.reserve(timeout)
+        if slot is None:
+            return False
+        slot[...] = frame
+        self.publish(sequence)
+        return True
+
+    def close_writer(self, sequence=END):
+        """Writer: publish an end (or ERROR) marker after the last frame"""
+        if self.reserve() is not None:
+            self.publish(sequence)
+
+    def get(self, timeout=None):
+        """Reader: (sequence, frame view) of the oldest published slot, or None after timeout seconds
+
+        The view is only valid until the slot is release()d.
+        """
+        if not self.filled.acquire(timeout=timeout):
+            return None
+        slot = self.read_pos % self.num_slots
+        self.read_pos += 1
+        return int(self.sequences[slot]), self.frames[slot]
+
+    def release(self):
+        """Reader: give the oldest slot still held back to the writer"""
+        self.free.release()
+
+    def stop(self):
+        """Reader: tell a writer waiting for a free slot to give up"""
+        self.stopped.set()
+
+    def close(self):
+        """Detach this process from the shared memory; views of it must no longer be used"""
+        self.sequences = self.frames = None
+        self.shm.close()
+
+    def unlink(self):
+        """Free the shared memory (the creating process, once both sides have closed)"""
+        self.shm.unlink()
+
+
+def decode_into(ring, video_path, size=(640, 480)):
+    """Decoder process: decode video_path and resize every frame straight into ring's slots
+
+    Each frame is tagged with its index in the video; the stream ends with
+    FrameRing.END, or FrameRing.ERROR if the video could not be opened.
+    """
+    cap = cv2.VideoCapture(video_path)
+    try:
+        if not cap.isOpened():
+            ring.close_writer(FrameRing.ERROR)
+            return
+        index = 0
+        while True:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            slot = ring.reserve()
+            if slot is None:
+                return
+            cv2.resize(frame, size, dst=slot)
+            ring.publish(index)
+            index += 1
+        ring.close_writer()
+    finally:
+        cap.release()
+        ring.close()
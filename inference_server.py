@@ -0,0 +1,488 @@
+"""One detection model shared by many junctions, batching frames across streams
+
+Start a server, then point junction controllers at it (see
+junction_controller.py's "inference_server" config key):
+
+    export INFERENCE_AUTHKEY=$(python -c "import secrets; print(secrets.token_hex(16))")
+    python inference_server.py --port 6000 --max-batch 16 --max-wait-ms 10
+
+Connections use multiprocessing.connection, which unpickles what the
+other side sends, so the shared key is all that keeps others from running
+code in the server. Clients and server read it from INFERENCE_AUTHKEY;
+without one the server makes up a key and prints it, and it only listens
+on other hosts than loopback with a key given explicitly.
+"""
+import hmac
+import ipaddress
+import itertools
+import multiprocessing
+import os
+import queue
+import secrets
+import threading
+import time
+import types
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from vehicle_detection import NO_DETECTIONS, RegionOfInterest, VehicleDetector
+
+# Environment variable holding the shared key of clients and server
+AUTHKEY_ENV = "INFERENCE_AUTHKEY"
+# Pending connections the listener queues (the default of 1 refuses junctions that start together)
+LISTEN_BACKLOG = 128
+
+
+def parse_address(text):
+    """("host", port) from "host:port" (or just "port" for localhost)"""
+    host, _, port = text.rpartition(":")
+    return host or "127.0.0.1", int(port)
+
+
+def env_authkey():
+    """The shared key from the INFERENCE_AUTHKEY environment variable, or None"""
+    key = os.environ.get(AUTHKEY_ENV)
+    return key.encode() if key else None
+
+
+def is_loopback(host):
+    """Whether host only accepts connections from this machine"""
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class InferenceServer:
+    """Runs one detector for many clients, batching their frames into shared model calls
+
+    Each client connection has a reader thread that queues its requests;
+    the batching loop takes the oldest request and waits up to
+    max_wait_ms after its arrival for others to join it, up to max_batch
+    frames. Frames with the same ROI (so the same crop size) go through
+    the model in one call, and every client gets back the filtered
+    detections of its own frames. max_wait_ms is the latency budget
+    traded for larger batches. A request with more frames than fit is
+    split across batches and answered once all its frames are done.
+
+    Only a client presenting shutdown_token can stop the server over a
+    connection; without a token, stop it with a signal (e.g. Ctrl-C).
+    """
+
+    def __init__(self, detector, max_batch=16, max_wait_ms=10, shutdown_token=None):
+        self.detector = detector
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.shutdown_token = shutdown_token
+        self.requests = queue.Queue()  # _Request objects, None to stop
+        self.leftover = None  # (request, first frame) of a request split at the end of the last batch
+        self.rois = {}
+        self.lock = threading.Lock()
+        self.clients = 0
+        self.batches = 0
+        self.frames = 0
+        self.model_calls = 0
+        self.busy_s = 0.0
+        self.start_time = time.monotonic()
+
+    def serve_forever(self, listener):
+        """Accept clients on listener and serve them until a client asks for shutdown"""
+        thread = threading.Thread(target=self._accept, args=(listener,), name="inference-accept")
+        thread.daemon = True
+        thread.start()
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            self._run_batch(batch)
+
+    def _accept(self, listener):
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                return
+            except Exception:
+                # Failed handshake (e.g. wrong authkey): keep serving the others
+                continue
+            with self.lock:
+                self.clients += 1
+            reply = _Reply(conn)
+            reply.send({"names": self.detector.model.names, "model_path": self.detector.model_path,
+                        "model_id": self.detector.model_id(), "backend": self.detector.backend})
+            thread = threading.Thread(target=self._read, args=(reply,), name="inference-client")
+            thread.daemon = True
+            thread.start()
+
+    def _read(self, reply):
+        try:
+            while True:
+                kind, request_id, payload, roi_key = reply.conn.recv()
+                if kind == "detect":
+                    self.requests.put(_Request(reply, request_id, payload, roi_key))
+                elif kind == "stats":
+                    reply.send(("stats", request_id, self.stats()))
+                elif kind == "shutdown":
+                    if self.shutdown_token is None or not isinstance(payload, bytes) or \
+                            not hmac.compare_digest(payload, self.shutdown_token):
+                        reply.send(("error", request_id, "shutdown refused: only the server's owner can stop it"))
+                        continue
+                    reply.send(("shutdown", request_id, None))
+                    self.requests.put(None)
+                    return
+        except (EOFError, OSError):
+            pass
+        finally:
+            with self.lock:
+                self.clients -= 1
+            reply.conn.close()
+
+    def _next_batch(self):
+        """(request, start, end) frame ranges of at most max_batch frames, or None to stop
+
+        The batch starts with what is left of a split request, or else the
+        oldest request, and takes any that arrive within its wait budget.
+        """
+        if self.leftover is not None:
+            request, start = self.leftover
+            self.leftover = None
+        else:
+            request, start = self.requests.get(), 0
+            if request is None:
+                return None
+        batch = []
+        frames = 0
+        deadline = request.arrived + self.max_wait_ms / 1000.0
+        while True:
+            end = min(len(request.frames), start + self.max_batch - frames)
+            batch.append((request, start, end))
+            frames += end - start
+            if end < len(request.frames):
+                self.leftover = (request, end)
+                break
+            if frames >= self.max_batch:
+                break
+            try:
+                request, start = self.requests.get(timeout=max(0.0, deadline - time.monotonic())), 0
+            except queue.Empty:
+                break
+            if request is None:
+                # Finish this batch first
+                self.requests.put(None)
+                break
+        return batch
+
+    def _roi(self, roi_key):
+        if roi_key is None:
+            return None
+        if roi_key not in self.rois:
+            self.rois[roi_key] = RegionOfInterest.parse(roi_key)
+        return self.rois[roi_key]
+
+    def _run_batch(self, batch):
+        started = time.monotonic()
+        # Only frames with the same crop size can share a model call
+        groups = {}
+        for part in batch:
+            if not part[0].failed:
+                groups.setdefault(part[0].roi_key, []).append(part)
+        for roi_key, parts in groups.items():
+            try:
+                roi = self._roi(roi_key)
+                frames = [frame for request, start, end in parts for frame in request.frames[start:end]]
+                results = self.detector.predict(frames, roi=roi)
+                detections = [self.detector._filter_detections(result, roi) for result in results]
+            except Exception as e:
+                for request, _, _ in parts:
+                    request.fail(str(e))
+                continue
+            self.model_calls += 1
+            offset = 0
+            for request, start, end in parts:
+                request.done(start, detections[offset:offset + end - start])
+                offset += end - start
+        self.batches += 1
+        self.frames += sum(end - start for _, start, end in batch)
+        self.busy_s += time.monotonic() - started
+
+    def stats(self):
+        elapsed = time.monotonic() - self.start_time
+        return {
+            "clients": self.clients,
+            "batches": self.batches,
+            "model_calls": self.model_calls,
+            "frames": self.frames,
+            "mean_batch": self.frames / self.batches if self.batches else 0.0,
+            "fps": self.frames / elapsed if elapsed > 0 else 0.0,
+            "utilisation": self.busy_s / elapsed if elapsed > 0 else 0.0,
+        }
+
+
+class _Request:
+    """One client's detect call, answered once detections for all its frames are in"""
+
+    def __init__(self, reply, request_id, frames, roi_key):
+        self.reply = reply
+        self.request_id = request_id
+        self.frames = frames
+        self.roi_key = roi_key
+        self.arrived = time.monotonic()
+        self.detections = [None] * len(frames)
+        self.remaining = len(frames)
+        self.failed = False
+
+    def done(self, start, detections):
+        self.detections[start:start + len(detections)] = detections
+        self.remaining -= len(detections)
+        if self.remaining == 0:
+            self.reply.send(("detections", self.request_id, self.detections))
+
+    def fail(self, message):
+        if not self.failed:
+            self.failed = True
+            self.reply.send(("error", self.request_id, message))
+
+
+class _Reply:
+    """A client connection whose sends are serialised between the batching loop and its reader thread"""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.lock = threading.Lock()
+
+    def send(self, message):
+        try:
+            with self.lock:
+                self.conn.send(message)
+        except (EOFError, OSError):
+            # The client went away; its reader thread cleans up
+            pass
+
+
+def _serve(address, authkey, shutdown_token, model_path, backend, max_batch, max_wait_ms, torch_threads, ready):
+    try:
+        if torch_threads is not None:
+            import torch
+            torch.set_num_threads(torch_threads)
+        detector = VehicleDetector(model_path=model_path, backend=backend)
+        listener = Listener(address, backlog=LISTEN_BACKLOG, authkey=authkey)
+    except Exception as e:
+        ready.put(e)
+        return
+    ready.put(listener.address)
+    try:
+        InferenceServer(detector, max_batch, max_wait_ms, shutdown_token).serve_forever(listener)
+    finally:
+        listener.close()
+
+
+class ServerProcess:
+    """An InferenceServer started by start_server: its process, address and shared key
+
+    Only this handle holds the token that stops the server.
+    """
+
+    def __init__(self, process, address, authkey, shutdown_token):
+        self.process = process
+        self.address = address
+        self.authkey = authkey
+        self._shutdown_token = shutdown_token
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def shutdown(self):
+        """Stop the server once it has answered the requests it already has, and wait for it to exit"""
+        client = InferenceClient(self.address, self.authkey)
+        try:
+            client.shutdown(self._shutdown_token)
+        finally:
+            client.close()
+        self.process.join()
+
+
+def start_server(model_path="yolov8n.pt", backend="torch", address=("127.0.0.1", 0), authkey=None,
+                 max_batch=16, max_wait_ms=10, torch_threads=None):
+    """Start an InferenceServer in a new process; returns a ServerProcess once it accepts clients
+
+    Port 0 picks a free port. Without authkey a random key is made up;
+    clients connect with the returned ServerProcess's authkey.
+    """
+    if authkey is None:
+        authkey = secrets.token_bytes(32)
+    shutdown_token = secrets.token_bytes(32)
+    # Spawn rather than fork: forking a process that already holds torch threads can deadlock
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    process = context.Process(target=_serve, args=(address, authkey, shutdown_token, model_path, backend, max_batch,
+                                                    max_wait_ms, torch_threads, ready), name="inference-server")
+    process.daemon = True
+    process.start()
+    while True:
+        try:
+            address = ready.get(timeout=1.0)
+            break
+        except queue.Empty:
+            if not process.is_alive():
+                raise RuntimeError(f"Inference server exited with code {process.exitcode}")
+    if isinstance(address, BaseException):
+        process.join()
+        raise address
+    return ServerProcess(process, address, authkey, shutdown_token)
+
+
+class InferenceClient:
+    """Connection to an InferenceServer; detect() sends frames and waits for their detections
+
+    It stands in for the YOLO model where only its class names are
+    needed. One request is in flight per client at a time; use a client
+    per stream to have the server batch streams together. authkey
+    defaults to the INFERENCE_AUTHKEY environment variable.
+    """
+
+    def __init__(self, address, authkey=None):
+        authkey = authkey or env_authkey()
+        if authkey is None:
+            raise ValueError(f"No key for the inference server: set {AUTHKEY_ENV} to the server's key")
+        self.conn = Client(address, authkey=authkey)
+        info = self.conn.recv()
+        self.names = info["names"]
+        self.model_path = info["model_path"]
+        self.model_id = info["model_id"]
+        self.backend = info["backend"]
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _request(self, kind, payload=None, roi_key=None):
+        with self._lock:
+            request_id = next(self._ids)
+            self.conn.send((kind, request_id, payload, roi_key))
+            reply, reply_id, payload = self.conn.recv()
+        if reply == "error":
+            raise RuntimeError(f"Inference server error: {payload}")
+        return payload
+
+    def detect(self, frames, roi=None):
+        """_filter_detections tuples for each 640x480 frame, in order"""
+        if not len(frames):
+            return []
+        return self._request("detect", np.stack(frames), roi.key() if roi is not None else None)
+
+    def stats(self):
+        return self._request("stats")
+
+    def shutdown(self, token):
+        """Stop the server once it has answered the requests it already has
+
+        token is the server's shutdown token (see ServerProcess); the server
+        refuses anyone else, raising RuntimeError here.
+        """
+        self._request("shutdown", token)
+
+    def close(self):
+        self.conn.close()
+
+
+class _HostArray(np.ndarray):
+    """NumPy array answering the cpu()/numpy() calls made on a YOLO result's box tensor"""
+
+    def cpu(self):
+        return self
+
+    def numpy(self):
+        return self.view(np.ndarray)
+
+
+class _RemoteResult:
+    """The parts of an ultralytics result that _filter_detections reads: boxes.xyxy, conf, cls and names"""
+
+    def __init__(self, rects, confs, class_ids, names):
+        self.boxes = types.SimpleNamespace(xyxy=rects.astype(np.float32).view(_HostArray),
+                                           conf=confs.astype(np.float32).view(_HostArray),
+                                           cls=class_ids.astype(np.float32).view(_HostArray))
+        self.names = names
+
+
+class RemoteDetector(VehicleDetector):
+    """VehicleDetector whose model runs on a shared InferenceServer
+
+    Decoding, motion gating, tracking and the green-time logic stay in
+    this process, which never loads the model; only the frames that need
+    it are sent to the server. Detections come back filtered with the
+    server detector's classes and confidence threshold.
+    """
+
+    def __init__(self, address, authkey=None, **kwargs):
+        self.client = InferenceClient(address, authkey)
+        super().__init__(model_path=self.client.model_path, backend=self.client.backend, lazy=True, **kwargs)
+        self._model_id = self.client.model_id
+        # The client has the server model's class names, which is all that is used of the model here
+        self._model = self.client
+        self._build_class_masks()
+        self._model_ready.set()
+
+    def _load_model(self, warm_up=False, show_error=False):
+        pass
+
+    def predict(self, frames, verbose=False, roi=None):
+        """Server detections of one frame or a list of 640x480 frames, as stand-ins for YOLO results
+
+        As with the model's own results, boxes are relative to the ROI crop
+        with roi, so _filter_detections takes them as they are. Only the
+        vehicle boxes the server kept are there.
+        """
+        if isinstance(frames, np.ndarray) and frames.ndim == 3:
+            frames = [frames]
+        x0, y0 = roi.bounds[:2] if roi is not None else (0, 0)
+        return [_RemoteResult(rects.reshape(-1, 4) - (x0, y0, x0, y0), confs, class_ids, self.client.names)
+                for rects, class_ids, confs, _ in self.client.detect(frames, roi)]
+
+    def _detect_batch(self, frames, roi=None, gate=None, last=NO_DETECTIONS, verbose=False):
+        needed = [gate is None or gate.needs_inference(frame) for frame in frames]
+        inferred = [frame for frame, need in zip(frames, needed) if need]
+        results = iter(self.client.detect(inferred, roi))
+        detections = []
+        for need in needed:
+            if need:
+                last = next(results)
+            detections.append(last)
+        return detections, needed
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from model_backends import BACKENDS
+
+    parser = argparse.ArgumentParser(description="Serve one detection model to many junction controllers")
+    parser.add_argument("--model", default="yolov8n.pt", help="YOLOv8 weights")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="inference backend")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=6000, help="port to listen on")
+    parser.add_argument("--authkey", help=f"shared key clients must present (default: ${AUTHKEY_ENV}, else a random "
+                                          "key that is printed; needed to listen beyond loopback)")
+    parser.add_argument("--max-batch", type=int, default=16, help="most frames per model call")
+    parser.add_argument("--max-wait-ms", type=float, default=10, help="longest a frame waits for a batch to fill")
+    args = parser.parse_args()
+
+    authkey = args.authkey.encode() if args.authkey else env_authkey()
+    if authkey is None:
+        if not is_loopback(args.host):
+            parser.error(f"listening on {args.host} needs a shared key: set {AUTHKEY_ENV} or pass --authkey")
+        authkey = secrets.token_hex(16).encode()
+        print(f"No key given; start clients with {AUTHKEY_ENV}={authkey.decode()}")
+
+    detector = VehicleDetector(model_path=args.model, backend=args.backend)
+    # Clients cannot stop this server; Ctrl-C (or another signal) does
+    server = InferenceServer(detector, args.max_batch, args.max_wait_ms)
+    with Listener((args.host, args.port), backlog=LISTEN_BACKLOG, authkey=authkey) as listener:
+        print(f"Serving {args.model} on {args.host}:{args.port}")
+        try:
+            server.serve_forever(listener)
+        except KeyboardInterrupt:
+            pass
+    print(server.stats())
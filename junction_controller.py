@@ -0,0 +1,632 @@
+"""Junction control with no GUI: measure the roads, then drive the signals
+
+Run a junction from a config file, e.g.
+
+    python junction_controller.py junction.json --cycles 3
+
+with a config such as
+
+    {"model": "yolov8n.pt", "mode": "sequential", "cycles": 1,
+     "roads": [{"name": "North", "source": "Videos/north.mp4",
+                "roi": [[100, 250], [560, 250], [630, 479], [20, 479]]},
+               {"name": "East", "source": "Videos/east.mp4"}]}
+
+Add "inference_server": "127.0.0.1:6000" to use a shared model server
+(see inference_server.py) instead of loading a model per junction; the
+server's key is read from the INFERENCE_AUTHKEY environment variable.
+"""
+import abc
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from signal_phases import ALL_RED_TIME, YELLOW_TIME, PhaseScheduler, build_phase_plan
+
+DEFAULT_GREEN_TIME = 10  # Seconds of green for a road with no video or whose measurement failed
+MODES = ("sequential", "parallel", "overlap")
+
+
+class InlineExecutor:
+    """Executor that runs each task at once on the calling thread, for controllers on a simulated clock"""
+
+    def submit(self, fn, *args, **kwargs):
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        pass
+
+
+class _MeasurementWorker:
+    """Where a controller's measurements run: the caller's executor, or a worker of the controller's own
+
+    Without an executor the controller owns a single-worker thread pool
+    (the measurements share a detector and run one at a time anyway) and
+    shuts it down when it stops. An executor passed in belongs to the
+    caller and is left running; only the measurements submitted here are
+    cancelled. A measurement already running when the controller is
+    cancelled is ignored; the default analysis stops at its next frame.
+    """
+
+    def __init__(self, executor=None):
+        self.owned = executor is None
+        self.executor = ThreadPoolExecutor(max_workers=1) if self.owned else executor
+        self.futures = []
+
+    def submit(self, fn, *args):
+        self.futures = [future for future in self.futures if not future.done()]
+        future = self.executor.submit(fn, *args)
+        self.futures.append(future)
+        return future
+
+    def close(self, cancel=False):
+        """Stop using the executor; with cancel, drop measurements that have not started"""
+        if cancel:
+            for future in self.futures:
+                future.cancel()
+        self.futures = []
+        if self.owned:
+            self.executor.shutdown(wait=False, cancel_futures=cancel)
+
+
+class OverlappedController:
+    """Serves roads one after another, measuring the next road while the current one is green
+
+    measure(road) returns (green_time, emergency_detected) for a road and
+    runs on a background thread. It is started for the following road as
+    soon as a road turns green, so its result is at most one phase old
+    when that road is actuated, and the junction only waits for a
+    measurement when it takes longer than the phase it overlaps with.
+
+    after(delay_ms, callback) and after_cancel(timer_id) are the timer API
+    (as for PhaseScheduler); every callback below runs from those timers:
+    on_phase(road, state, duration) at each phase change,
+    on_measured(road, green_time, emergency, data_age_s, idle_s) just
+    before a road turns green, on_error(road, exception) when a
+    measurement fails (the road then gets DEFAULT_GREEN_TIME), and
+    on_complete() after the last phase. With cycles=None the roads are
+    served round robin until cancel(). executor runs the measurements
+    (see _MeasurementWorker), and on_measuring(road) is called when a
+    road's measurement is started.
+    """
+
+    def __init__(self, roads, measure, after, after_cancel, on_phase, on_measured=None, on_error=None,
+                 on_complete=None, cycles=1, poll_ms=50, clock=time.monotonic, yellow_time=YELLOW_TIME,
+                 all_red_time=ALL_RED_TIME, executor=None, on_measuring=None):
+        self.roads = list(roads)
+        self.measure = measure
+        self.after = after
+        self.after_cancel = after_cancel
+        self.on_measured = on_measured
+        self.on_error = on_error
+        self.on_complete = on_complete
+        self.on_measuring = on_measuring
+        self.cycles = cycles
+        self.poll_ms = poll_ms
+        self.clock = clock
+        self.yellow_time = yellow_time
+        self.all_red_time = all_red_time
+        self.scheduler = PhaseScheduler(after, after_cancel, on_phase, self._phases_done, clock=clock)
+        self.executor = executor
+        self.worker = None
+        self.pending = None  # (turn, future, submit_time) for the next road's measurement
+        self.turn = 0
+        self.wait_started = None
+        self.poll_id = None
+        self.actuations = []  # One dict per road actuation, see stats()
+
+    @property
+    def running(self):
+        return self.worker is not None
+
+    def start(self):
+        self.cancel()
+        self.actuations = []
+        self.turn = 0
+        if not self.roads or self.cycles == 0:
+            if self.on_complete:
+                self.on_complete()
+            return
+        self.worker = _MeasurementWorker(self.executor)
+        self._submit(0)
+        self._wait()
+
+    def cancel(self):
+        """Stop at once (see _MeasurementWorker for a measurement still running)"""
+        self.scheduler.cancel()
+        if self.poll_id is not None:
+            self.after_cancel(self.poll_id)
+            self.poll_id = None
+        if self.worker is not None:
+            self.worker.close(cancel=True)
+            self.worker = None
+        self.pending = None
+
+    def _road(self, turn):
+        return self.roads[turn % len(self.roads)]
+
+    def _last_turn(self):
+        return None if self.cycles is None else self.cycles * len(self.roads) - 1
+
+    def _submit(self, turn):
+        last = self._last_turn()
+        if last is not None and turn > last:
+            self.pending = None
+            return
+        road = self._road(turn)
+
+        def run():
+            result = self.measure(road)
+            return result, self.clock()
+
+        self.pending = (turn, self.worker.submit(run), self.clock())
+        if self.on_measuring:
+            self.on_measuring(road)
+
+    def _wait(self):
+        """Actuate the current turn's road once its measurement is in, polling until then"""
+        self.poll_id = None
+        _, future, _ = self.pending
+        if not future.done():
+            if self.wait_started is None:
+                self.wait_started = self.clock()
+            self.poll_id = self.after(self.poll_ms, self._wait)
+            return
+        self._actuate(future)
+
+    def _actuate(self, future):
+        turn, road = self.turn, self._road(self.turn)
+        now = self.clock()
+        idle = now - self.wait_started if self.wait_started is not None else 0.0
+        self.wait_started = None
+        try:
+            (green_time, emergency), measured_at = future.result()
+        except Exception as e:
+            green_time, emergency, measured_at = DEFAULT_GREEN_TIME, False, now
+            if self.on_error:
+                self.on_error(road, e)
+        data_age = now - measured_at
+        self.actuations.append({"turn": turn, "road": road, "green_time": green_time,
+                                "emergency": emergency, "data_age_s": data_age, "idle_s": idle})
+        if self.on_measured:
+            self.on_measured(road, green_time, emergency, data_age, idle)
+
+        # Measure the next road while this one is green
+        self._submit(turn + 1)
+        self.scheduler.start([(road, "green", green_time), (road, "yellow", self.yellow_time),
+                              (road, "red", self.all_red_time)])
+
+    def _phases_done(self):
+        self.turn += 1
+        if self.pending is None:
+            worker, self.worker = self.worker, None
+            if worker is not None:
+                worker.close()
+            if self.on_complete:
+                self.on_complete()
+            return
+        self._wait()
+
+    def stats(self):
+        """Per-actuation records plus mean / max data age and total idle time in seconds"""
+        ages = [a["data_age_s"] for a in self.actuations]
+        idle = [a["idle_s"] for a in self.actuations]
+        return {
+            "actuations": list(self.actuations),
+            "mean_data_age_s": sum(ages) / len(ages) if ages else 0.0,
+            "max_data_age_s": max(ages, default=0.0),
+            "idle_s": sum(idle),
+        }
+
+
+class Road:
+    """One approach of a junction: its name, video source (None if it has none) and optional RegionOfInterest"""
+
+    def __init__(self, name, source=None, roi=None):
+        self.name = name
+        self.source = source
+        self.roi = roi
+
+
+def load_junction_config(path):
+    """Read a junction config file (see the module docstring) into a dict with Road objects under "roads"
+
+    Relative video file paths are taken relative to the config file.
+    """
+    with open(path) as f:
+        config = json.load(f)
+    if config.get("mode", "sequential") not in MODES:
+        raise ValueError(f"Unknown mode {config['mode']!r}, expected one of {', '.join(MODES)}")
+    roads = []
+    for road in config.get("roads", []):
+        source, roi = road.get("source"), road.get("roi")
+        if source is not None and "://" not in source and not os.path.isabs(source):
+            source = os.path.join(os.path.dirname(os.path.abspath(path)), source)
+        if roi is not None:
+            from vehicle_detection import RegionOfInterest
+            roi = RegionOfInterest(roi)
+        roads.append(Road(road["name"], source, roi))
+    if not roads:
+        raise ValueError(f"No roads in {path}")
+    config["roads"] = roads
+    return config
+
+
+class SignalOutput(abc.ABC):
+    """Where a controller sends signal states: a display, a signal hardware interface, a recorder
+
+    Subclass it, or pass any object with the same show() method.
+    """
+
+    @abc.abstractmethod
+    def show(self, road, state, duration=None):
+        """Set road (an index) to state "green", "yellow", "red" or "off" for duration seconds
+
+        duration is None for states held until the next change.
+        """
+
+
+class SignalStates(SignalOutput):
+    """Keeps the current state of each road and counts changes, for running without signal hardware"""
+
+    def __init__(self, num_roads):
+        self.states = ["off"] * num_roads
+        self.changes = 0
+
+    def show(self, road, state, duration=None):
+        self.states[road] = state
+        self.changes += 1
+
+
+def _print_log(message, **fields):
+    print(message)
+
+
+class JunctionController:
+    """Runs a junction with no GUI: measures its roads, then takes the signals through the phase plan
+
+    Each cycle every road is measured on a background thread - one after
+    another ("sequential") or all at once in a process pool ("parallel")
+    - and then served in turn for its measured green time. In "overlap"
+    mode each road is instead measured while the road before it is green
+    (see OverlappedController). Roads without a source, or whose
+    measurement fails, get DEFAULT_GREEN_TIME. cycles=None repeats until
+    cancel().
+
+    Signal states go to output.show(road, state, duration). after and
+    after_cancel are the timer API - Tk's in the GUI, a TimerLoop's when
+    headless - and all callbacks run from those timers, so a view never
+    deals with threads: on_measuring(road) when a road's measurement
+    starts, on_measured(road, green_time, emergency) as each road's result
+    comes in and on_complete() after the last cycle. measure(road)
+    replaces the default measurement, a headless analyze_video of the
+    road's source on detector, and runs on the background thread.
+    log(message, **fields) may be called from any thread. executor runs
+    the measurements (see _MeasurementWorker; an InlineExecutor for
+    simulations on a virtual clock).
+    """
+
+    def __init__(self, roads, output, after, after_cancel, detector=None, mode="sequential", cycles=1,
+                 measure=None, log=_print_log, on_measured=None, on_complete=None, yellow_time=YELLOW_TIME,
+                 all_red_time=ALL_RED_TIME, poll_ms=50, clock=time.monotonic, executor=None, on_measuring=None):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r}, expected one of {', '.join(MODES)}")
+        self.roads = list(roads)
+        self.output = output
+        self.after = after
+        self.after_cancel = after_cancel
+        self.detector = detector
+        self.mode = mode
+        self.cycles = cycles
+        self.measure = measure or self.analyze_road
+        self.log = log
+        self.on_measured = on_measured
+        self.on_complete = on_complete
+        self.yellow_time = yellow_time
+        self.all_red_time = all_red_time
+        self.poll_ms = poll_ms
+        self.clock = clock
+        self.scheduler = PhaseScheduler(after, after_cancel, self._on_phase, self._phases_done, clock=clock)
+        self.overlapped = None
+        self.executor = executor
+        self.worker = None
+        self.on_measuring = on_measuring
+        self.cancelled = threading.Event()
+        self.results = queue.SimpleQueue()  # (road, green_time, emergency, error) from the measuring thread
+        self.measuring = queue.SimpleQueue()  # Roads whose measurement the measuring thread has started
+        self.pending = None  # Future of the current cycle's measurements
+        self.poll_id = None
+        self.road_times = [0] * len(self.roads)
+        self.plan = []
+        self.measure_time = 0.0
+        self.cycle = 0
+        self.cycle_started = None
+        self.running = False
+        self.cycle_stats = []  # One dict per completed cycle, see stats()
+        self.overlap_stats = None  # The last overlapped run's OverlappedController.stats()
+
+    def start(self):
+        self.cancel()
+        self.cancelled = threading.Event()
+        self.results = queue.SimpleQueue()
+        self.measuring = queue.SimpleQueue()
+        self.cycle = 0
+        self.cycle_stats = []
+        self.overlap_stats = None
+        self.running = True
+        for road in range(len(self.roads)):
+            self.output.show(road, "red")
+
+        if self.mode == "overlap":
+            self.log("Starting overlapped traffic control: each road is analysed while the previous one is green")
+            self.overlapped = OverlappedController(range(len(self.roads)), self._measure_road, self.after,
+                                                   self.after_cancel, self._on_phase, self._overlap_measured,
+                                                   self._overlap_failed, self._finish, cycles=self.cycles,
+                                                   poll_ms=self.poll_ms, clock=self.clock,
+                                                   yellow_time=self.yellow_time, all_red_time=self.all_red_time,
+                                                   executor=self.executor, on_measuring=self.on_measuring)
+            self.overlapped.start()
+            return
+        self.worker = _MeasurementWorker(self.executor)
+        self._start_cycle()
+
+    def cancel(self):
+        """Stop at once (see _MeasurementWorker for a measurement still running)"""
+        self.running = False
+        self.cancelled.set()
+        self.scheduler.cancel()
+        if self.poll_id is not None:
+            self.after_cancel(self.poll_id)
+            self.poll_id = None
+        if self.worker is not None:
+            self.worker.close(cancel=True)
+            self.worker = None
+        if self.overlapped is not None:
+            self.overlapped.cancel()
+            self.overlap_stats = self.overlapped.stats()
+            self.overlapped = None
+        self.pending = None
+
+    def analyze_road(self, road):
+        """Default measurement: (green_time, emergency_detected) from a headless analysis of the road's video"""
+        road = self.roads[road]
+        # Stops at the next frame once the controller is cancelled, so Ctrl-C need not wait for the video
+        stats = self.detector.analyze_video(road.source, keep_frames=False, roi=road.roi, cancelled=self.cancelled)
+        return stats["green_time"], stats["emergency_detected"]
+
+    def _measure_road(self, road):
+        source = self.roads[road].source
+        if source is None:
+            self.log(f"No video for {self.roads[road].name} Road, using {DEFAULT_GREEN_TIME}s",
+                     road=self.roads[road].name)
+            return DEFAULT_GREEN_TIME, False
+        self.log(f"Processing {self.roads[road].name} Road: {os.path.basename(str(source))}",
+                 road=self.roads[road].name)
+        if self.mode != "overlap":
+            # The overlapped controller reports the start of its measurements from the timers itself
+            self.measuring.put(road)
+        return self.measure(road)
+
+    def _start_cycle(self):
+        self.road_times = [0] * len(self.roads)
+        self.cycle_started = self.clock()
+        self.pending = self.worker.submit(self._measure_all, self.results, self.cancelled)
+        self._poll()
+
+    def _measure_all(self, results, cancelled):
+        """Measure every road on the worker thread, queueing each result; returns the time spent"""
+        start = self.clock()
+        if self.mode == "parallel":
+            self._measure_parallel(results)
+        else:
+            for road in range(len(self.roads)):
+                if cancelled.is_set():
+                    break
+                try:
+                    green_time, emergency = self._measure_road(road)
+                except Exception as e:
+                    results.put((road, None, None, e))
+                else:
+                    results.put((road, green_time, emergency, None))
+        return self.clock() - start
+
+    def _measure_parallel(self, results):
+        from vehicle_detection import analyze_videos_parallel
+
+        roads = [road for road, r in enumerate(self.roads) if r.source is not None]
+        for road in range(len(self.roads)):
+            if road not in roads:
+                results.put((road,) + self._measure_road(road) + (None,))
+        if not roads:
+            return
+        self.log(f"Processing {len(roads)} roads in parallel")
+        for road in roads:
+            self.measuring.put(road)
+        done = set()
+        try:
+            for index, stats in analyze_videos_parallel([self.roads[road].source for road in roads],
+                                                        model_path=self.detector.model_path,
+                                                        tracker_options=self.detector.tracker_options,
+                                                        backend=self.detector.backend,
+                                                        rois=[self.roads[road].roi for road in roads]):
+                results.put((roads[index], stats["green_time"], stats["emergency_detected"], None))
+                done.add(roads[index])
+        except Exception as e:
+            for road in roads:
+                if road not in done:
+                    results.put((road, None, None, e))
+
+    def _poll(self):
+        """Report measurements as they come in, then start the phase plan once the cycle's are all in"""
+        self.poll_id = None
+        finished = self.pending.done()
+        while True:
+            try:
+                road = self.measuring.get_nowait()
+            except queue.Empty:
+                break
+            if self.on_measuring:
+                self.on_measuring(road)
+        while True:
+            try:
+                road, green_time, emergency, error = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self._measured(road, green_time, emergency, error)
+        if not finished:
+            self.poll_id = self.after(self.poll_ms, self._poll)
+            return
+
+        self.measure_time = self.pending.result()
+        self.pending = None
+        self.log("Starting traffic signal sequence", cycle=self.cycle)
+        self.plan = build_phase_plan(self.road_times, self.yellow_time, self.all_red_time)
+        self.scheduler.start(self.plan)
+
+    def _measured(self, road, green_time, emergency, error=None):
+        name = self.roads[road].name
+        if error is not None:
+            self.log(f"Analysis of {name} Road failed: {error}", road=name)
+            green_time, emergency = DEFAULT_GREEN_TIME, False
+        self.road_times[road] = green_time
+        if emergency:
+            self.log(f"⚠️ Emergency vehicle detected on {name} Road", road=name, emergency=True)
+        self.log(f"{name} Road Green Time: {green_time} seconds", road=name, green_time=green_time)
+        if self.on_measured:
+            self.on_measured(road, green_time, emergency)
+
+    def _overlap_measured(self, road, green_time, emergency, data_age, idle):
+        self._measured(road, green_time, emergency)
+        self.log(f"  data age {data_age:.1f}s at actuation, waited {idle:.1f}s for analysis",
+                 road=self.roads[road].name, data_age_s=data_age, idle_s=idle)
+
+    def _overlap_failed(self, road, error):
+        self.log(f"Analysis of {self.roads[road].name} Road failed: {error}", road=self.roads[road].name)
+
+    def _on_phase(self, road, state, duration):
+        name = self.roads[road].name
+        if state == "red":
+            # Red holds for the gap before the next road turns green
+            self.log(f"RED signal for {name} Road", road=name, state=state)
+        else:
+            self.log(f"{state.upper()} signal for {name} Road: {duration} seconds", road=name, state=state,
+                     duration=duration)
+        self.output.show(road, state, duration)
+
+    def _phases_done(self):
+        now = self.clock()
+        planned = sum(duration for _, _, duration in self.plan)
+        self.cycle_stats.append({
+            "cycle": self.cycle,
+            "road_times": list(self.road_times),
+            "measure_s": self.measure_time,
+            "phases_s": planned,
+            "total_s": now - self.cycle_started,
+            # Time spent in neither measuring nor the planned phases
+            "overhead_s": now - self.cycle_started - self.measure_time - planned,
+        })
+        self.cycle += 1
+        if self.cycles is None or self.cycle < self.cycles:
+            self._start_cycle()
+        else:
+            self._finish()
+
+    def _finish(self):
+        if self.overlapped is not None:
+            stats = self.overlap_stats = self.overlapped.stats()
+            self.log(f"Mean data age at actuation {stats['mean_data_age_s']:.1f}s "
+                     f"(max {stats['max_data_age_s']:.1f}s), idle {stats['idle_s']:.1f}s")
+            self.overlapped = None
+        if self.worker is not None:
+            self.worker.close()
+            self.worker = None
+        self.running = False
+        self.log("Traffic control sequence completed")
+        if self.on_complete:
+            self.on_complete()
+
+    def stats(self):
+        """Per-cycle records plus the mean controller overhead per cycle in seconds
+
+        Overlap mode has no cycles; its stats hold the overlapped
+        controller's actuation records, data age and idle time instead,
+        with a summary per road name under "roads".
+        """
+        overheads = [c["overhead_s"] for c in self.cycle_stats]
+        stats = {
+            "cycles": list(self.cycle_stats),
+            "mean_overhead_s": sum(overheads) / len(overheads) if overheads else 0.0,
+        }
+        overlapped = self.overlapped.stats() if self.overlapped is not None else self.overlap_stats
+        if overlapped is not None:
+            stats.update(overlapped)
+            stats["roads"] = {}
+            for index, road in enumerate(self.roads):
+                actuations = [a for a in overlapped["actuations"] if a["road"] == index]
+                ages = [a["data_age_s"] for a in actuations]
+                stats["roads"][road.name] = {
+                    "actuations": len(actuations),
+                    "green_s": sum(a["green_time"] for a in actuations),
+                    "mean_data_age_s": sum(ages) / len(ages) if ages else 0.0,
+                    "max_data_age_s": max(ages, default=0.0),
+                    "idle_s": sum(a["idle_s"] for a in actuations),
+                }
+        return stats
+
+
+if __name__ == "__main__":
+    import argparse
+    import logging
+
+    from event_log import EventLog
+    from signal_phases import TimerLoop
+    from vehicle_detection import VehicleDetector
+
+    parser = argparse.ArgumentParser(description="Run a junction from a config file, without a GUI")
+    parser.add_argument("config", help="junction config file (JSON)")
+    parser.add_argument("--mode", choices=MODES, help="measurement mode (overrides the config)")
+    parser.add_argument("--cycles", type=int, help="cycles to run, 0 for no limit (overrides the config)")
+    parser.add_argument("--log-file", default=os.path.join("logs", "events.jsonl"),
+                        help="JSON-lines event file")
+    args = parser.parse_args()
+
+    config = load_junction_config(args.config)
+    cycles = config.get("cycles", 1) if args.cycles is None else args.cycles
+    mode = args.mode or config.get("mode", "sequential")
+    if config.get("inference_server") and mode == "parallel":
+        parser.error("parallel mode starts its own model processes; use sequential or overlap mode "
+                     "with an inference server")
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%H:%M:%S"))
+    event_log = EventLog(args.log_file, handlers=(console,))
+    if config.get("inference_server"):
+        # The model runs in a shared server that batches frames across junctions
+        from inference_server import RemoteDetector, parse_address
+        detector = RemoteDetector(parse_address(config["inference_server"]), log=event_log.log,
+                                  tracker_options=config.get("tracker"))
+    else:
+        # The model loads on first use, and never in this process in parallel mode
+        detector = VehicleDetector(model_path=config.get("model", "yolov8n.pt"), lazy=True, log=event_log.log,
+                                   backend=config.get("backend", "torch"), tracker_options=config.get("tracker"))
+    loop = TimerLoop()
+    controller = JunctionController(config["roads"], SignalStates(len(config["roads"])), loop.after,
+                                    loop.after_cancel, detector=detector, mode=mode, cycles=cycles or None,
+                                    log=event_log.log, on_complete=loop.stop,
+                                    yellow_time=config.get("yellow_time", YELLOW_TIME),
+                                    all_red_time=config.get("all_red_time", ALL_RED_TIME))
+    loop.after(0, controller.start)
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        controller.cancel()
+    finally:
+        event_log.close()
+    print(json.dumps(controller.stats(), indent=2))
@@ -0,0 +1,287 @@
+"""Discrete-event junction simulation for comparing signal policies faster than real time
+
+Vehicles arrive on each road, queue, and leave at the saturation flow
+while their road is green. The signals are run by the same
+JunctionController and phase scheduler as a live junction, on a virtual
+clock, with the detector replaced by a count of the vehicles queued when
+a road is measured. Run from the repository root, e.g.
+
+    python junction_sim.py sim.json --hours 8 --policy sequential overlap fixed:30
+
+with a config such as
+
+    {"headway_s": 2.0,
+     "roads": [{"name": "North", "rate_per_hour": 600},
+               {"name": "East", "counts": [12, 30, 18], "interval_s": 300},
+               {"name": "South", "trace": "traces/south", "fps": 30},
+               {"name": "West", "rate_per_hour": 200}]}
+"""
+import collections
+import json
+import math
+import os
+import random
+import time
+
+from junction_controller import DEFAULT_GREEN_TIME, InlineExecutor, JunctionController, Road
+from signal_phases import ALL_RED_TIME, YELLOW_TIME, VirtualTimerLoop
+from vehicle_detection import calculate_green_time
+
+STARTUP_LOST_S = 2.0  # Seconds from green until the first queued vehicle leaves
+SATURATION_HEADWAY_S = 2.0  # Seconds between vehicles leaving a queue on green
+POLICIES = ("sequential", "overlap")  # Controller modes whose measurement can be simulated
+
+
+def poisson_arrivals(rate_per_hour, rng):
+    """Arrival times (s) of a Poisson stream of rate_per_hour vehicles"""
+    t = 0.0
+    if rate_per_hour <= 0:
+        return
+    while True:
+        t += rng.expovariate(rate_per_hour / 3600.0)
+        yield t
+
+
+def counted_arrivals(counts, interval_s, rng, repeat=True):
+    """Arrival times (s) for counts[i] vehicles spread at random over the i-th interval_s window
+
+    With repeat, the recorded counts are replayed end to end for as long
+    as the simulation runs.
+    """
+    start = 0.0
+    while True:
+        for count in counts:
+            for offset in sorted(rng.uniform(0, interval_s) for _ in range(int(count))):
+                yield start + offset
+            start += interval_s
+        if not repeat or not any(counts):
+            return
+
+
+def trace_counts(path, interval_s=60.0, fps=30.0, tracker_options=None):
+    """New vehicles per interval_s window of a detection trace, from the tracker's new object IDs"""
+    from centroid_tracker import CentroidTracker
+    from detection_trace import DetectionTrace
+
+    trace = DetectionTrace(path)
+    ct = CentroidTracker(**(tracker_options or {}))
+    counts = []
+    registered = 0
+    for frame_index, rects, _, _ in trace.frames():
+        ct.update(rects)
+        window = int(frame_index / fps // interval_s)
+        while len(counts) <= window:
+            counts.append(0)
+        # Every newly registered object is a vehicle that arrived in view
+        counts[window] += ct.nextObjectID - registered
+        registered = ct.nextObjectID
+    return counts
+
+
+def parse_policy(policy):
+    """(controller mode, fixed green time or None) for a policy name; ValueError if it cannot be simulated"""
+    if policy.startswith("fixed:"):
+        try:
+            green_time = float(policy.split(":", 1)[1])
+        except ValueError:
+            raise ValueError(f"Fixed green time must be a number of seconds: {policy!r}") from None
+        if not 0 < green_time < math.inf:
+            raise ValueError(f"Fixed green time must be a positive number of seconds: {policy!r}")
+        return "sequential", green_time
+    if policy in POLICIES:
+        return policy, None
+    # "parallel" measures videos with a detector, which a simulation does not have
+    raise ValueError(f"Unknown policy {policy!r}: use {', '.join(POLICIES)} or fixed:<seconds>")
+
+
+class SimRoad:
+    """Queue of one approach: arrival times of the waiting vehicles, plus delay and queue statistics"""
+
+    def __init__(self, name, arrivals):
+        self.name = name
+        self.arrivals = arrivals
+        self.queue = collections.deque()
+        self.green = False
+        self.discharge_id = None
+        self.arrived = 0
+        self.departed = 0
+        self.delays = []
+        self.max_queue = 0
+        self.queue_area = 0.0  # Integral of queue length over time, for the time-weighted mean
+        self.last_change = 0.0
+
+    def _changed(self, now):
+        self.queue_area += len(self.queue) * (now - self.last_change)
+        self.last_change = now
+
+    def arrive(self, now):
+        self._changed(now)
+        self.queue.append(now)
+        self.arrived += 1
+        self.max_queue = max(self.max_queue, len(self.queue))
+
+    def depart(self, now):
+        self._changed(now)
+        self.delays.append(now - self.queue.popleft())
+        self.departed += 1
+
+    def stats(self, now):
+        self._changed(now)
+        delays = sorted(self.delays)
+        return {
+            "arrived": self.arrived,
+            "departed": self.departed,
+            "mean_delay_s": sum(delays) / len(delays) if delays else 0.0,
+            "p95_delay_s": delays[int(len(delays) * 0.95)] if delays else 0.0,
+            "mean_queue": self.queue_area / now if now > 0 else 0.0,
+            "max_queue": self.max_queue,
+            "queued_at_end": len(self.queue),
+        }
+
+
+class JunctionSimulation:
+    """One junction run on a virtual clock under a signal policy
+
+    policy is a JunctionController mode in POLICIES whose measurement
+    counts the vehicles queued on the road and turns them into a green
+    time with calculate_green_time, or "fixed:<seconds>" for a fixed-time
+    plan; anything else raises ValueError. Each road's arrivals is an iterator of arrival times
+    in seconds. While a road is green its queue discharges one vehicle
+    every headway_s after a startup_s lost time; yellow and red hold it.
+    """
+
+    def __init__(self, names, arrivals, policy="sequential", headway_s=SATURATION_HEADWAY_S,
+                 startup_s=STARTUP_LOST_S, yellow_time=YELLOW_TIME, all_red_time=ALL_RED_TIME):
+        self.roads = [SimRoad(name, iter(times)) for name, times in zip(names, arrivals)]
+        self.policy = policy
+        self.headway_s = headway_s
+        self.startup_s = startup_s
+        self.timers = VirtualTimerLoop()
+
+        mode, green_time = parse_policy(policy)
+        measure = self._measure if green_time is None else lambda road: (green_time, False)
+        # Every road has a (simulated) camera; instant measurements keep runs deterministic
+        self.controller = JunctionController([Road(name, "simulated") for name in names], self,
+                                             self.timers.after, self.timers.after_cancel, mode=mode, cycles=None,
+                                             measure=measure, log=lambda message, **fields: None,
+                                             yellow_time=yellow_time, all_red_time=all_red_time,
+                                             clock=self.timers.clock, executor=InlineExecutor())
+        self.measurements = 0
+
+    def _measure(self, road):
+        self.measurements += 1
+        return calculate_green_time(len(self.roads[road].queue)), False
+
+    def _schedule_arrival(self, road):
+        arrival = next(self.roads[road].arrivals, None)
+        if arrival is not None:
+            self.timers.after((arrival - self.timers.now) * 1000.0, self._arrive, road)
+
+    def _arrive(self, road):
+        self.roads[road].arrive(self.timers.now)
+        self._schedule_arrival(road)
+
+    def _discharge(self, road):
+        sim_road = self.roads[road]
+        if sim_road.queue:
+            sim_road.depart(self.timers.now)
+        sim_road.discharge_id = self.timers.after(self.headway_s * 1000.0, self._discharge, road)
+
+    def show(self, road, state, duration=None):
+        """Signal output: start or stop discharging a road's queue"""
+        sim_road = self.roads[road]
+        if state == "green" and not sim_road.green:
+            sim_road.green = True
+            sim_road.discharge_id = self.timers.after(self.startup_s * 1000.0, self._discharge, road)
+        elif state != "green" and sim_road.green:
+            sim_road.green = False
+            if sim_road.discharge_id is not None:
+                self.timers.after_cancel(sim_road.discharge_id)
+                sim_road.discharge_id = None
+
+    def run(self, duration_s):
+        """Simulate duration_s seconds of operation; returns junction-wide and per-road statistics"""
+        start = time.perf_counter()
+        for road in range(len(self.roads)):
+            self._schedule_arrival(road)
+        self.timers.after(0, self.controller.start)
+        self.timers.run(until=duration_s)
+        self.controller.cancel()
+        wall_s = time.perf_counter() - start
+
+        roads = {road.name: road.stats(duration_s) for road in self.roads}
+        delays = sorted(delay for road in self.roads for delay in road.delays)
+        departed = sum(road.departed for road in self.roads)
+        return {
+            "policy": self.policy,
+            "simulated_s": duration_s,
+            "wall_s": wall_s,
+            "speedup": duration_s / wall_s if wall_s > 0 else float("inf"),
+            "cycles": self.controller.cycle if self.controller.mode != "overlap" else None,
+            "arrived": sum(road.arrived for road in self.roads),
+            "departed": departed,
+            "throughput_per_hour": departed / duration_s * 3600.0,
+            "mean_delay_s": sum(delays) / len(delays) if delays else 0.0,
+            "p95_delay_s": delays[int(len(delays) * 0.95)] if delays else 0.0,
+            "mean_queue": sum(stats["mean_queue"] for stats in roads.values()),
+            "max_queue": max(stats["max_queue"] for stats in roads.values()),
+            "queued_at_end": sum(stats["queued_at_end"] for stats in roads.values()),
+            "roads": roads,
+        }
+
+
+def load_arrivals(config, seed=0, config_dir="."):
+    """(names, arrival iterators) for the roads of a simulation config (see the module docstring)"""
+    rng = random.Random(seed)
+    names, arrivals = [], []
+    for road in config["roads"]:
+        names.append(road["name"])
+        if "trace" in road:
+            interval_s = road.get("interval_s", 60.0)
+            counts = trace_counts(os.path.join(config_dir, road["trace"]), interval_s, road.get("fps", 30.0))
+            arrivals.append(counted_arrivals(counts, interval_s, rng))
+        elif "counts" in road:
+            arrivals.append(counted_arrivals(road["counts"], road.get("interval_s", 60.0), rng))
+        else:
+            arrivals.append(poisson_arrivals(road.get("rate_per_hour", 0), rng))
+    return names, arrivals
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Compare signal policies on a simulated junction")
+    parser.add_argument("config", help="simulation config file (JSON)")
+    parser.add_argument("--hours", type=float, default=1.0, help="simulated hours of operation")
+    parser.add_argument("--policy", nargs="+", default=["sequential", "overlap", f"fixed:{DEFAULT_GREEN_TIME}"],
+                        help='policies to compare: sequential, overlap or fixed:<green seconds>')
+    parser.add_argument("--seed", type=int, default=0, help="random seed for arrivals")
+    parser.add_argument("--json", action="store_true", help="print full results as JSON")
+    args = parser.parse_args()
+    for policy in args.policy:
+        try:
+            parse_policy(policy)
+        except ValueError as e:
+            parser.error(str(e))
+
+    with open(args.config) as f:
+        config = json.load(f)
+    results = []
+    for policy in args.policy:
+        # The same arrivals for every policy
+        names, arrivals = load_arrivals(config, args.seed, os.path.dirname(os.path.abspath(args.config)))
+        simulation = JunctionSimulation(names, arrivals, policy, headway_s=config.get("headway_s", SATURATION_HEADWAY_S),
+                                        startup_s=config.get("startup_s", STARTUP_LOST_S),
+                                        yellow_time=config.get("yellow_time", YELLOW_TIME),
+                                        all_red_time=config.get("all_red_time", ALL_RED_TIME))
+        results.append(simulation.run(args.hours * 3600.0))
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        print(f"{'policy':>12} {'veh/h':>7} {'mean delay s':>13} {'p95 delay s':>12} {'mean queue':>11} "
+              f"{'max queue':>10} {'left queued':>12} {'wall s':>7} {'speedup':>9}")
+        for r in results:
+            print(f"{r['policy']:>12} {r['throughput_per_hour']:>7.0f} {r['mean_delay_s']:>13.1f} "
+                  f"{r['p95_delay_s']:>12.1f} {r['mean_queue']:>11.1f} {r['max_queue']:>10} {r['queued_at_end']:>12} {r['wall_s']:>7.2f} "
+                  f"{r['speedup']:>8.0f}x")
@@ -0,0 +1,240 @@
+"""Live vehicle counts from camera, stream or real-time file sources
+
+Run from the repository root, e.g.
+
+    python live_stream.py 0 rtsp://camera/east Videos/Backup.mp4
+"""
+import collections
+import os
+import threading
+import time
+
+import cv2
+
+from vehicle_detection import NO_DETECTIONS, calculate_green_time
+
+
+def open_capture(source):
+    """cv2.VideoCapture for a camera index, stream URL or file path (all-digit strings are camera indices)"""
+    if isinstance(source, str) and source.isdigit():
+        source = int(source)
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise ValueError(f"Could not open video source: {source}")
+    # Keep the driver from buffering frames we would only throw away (not every backend supports it)
+    cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+    return cap
+
+
+class LiveRoadMonitor:
+    """Rolling vehicle count for one road from a live video source
+
+    A capture thread reads frames as fast as the source delivers them and
+    keeps only the newest one; the analysis thread always takes the newest,
+    so frames that arrive while the model is busy are dropped rather than
+    queued, and the count never lags behind the camera by more than one
+    inference. Each analysed frame's tracked count goes into a sliding
+    window of window_s seconds, whose peak gives current_green_time(). That
+    query only reads the window, so a controller can poll it at any moment
+    from any thread.
+
+    Local files stand in for cameras: with realtime (the default for
+    files) they are read at their own frame rate, as a camera would
+    deliver them.
+    """
+
+    def __init__(self, detector, source, roi=None, window_s=30.0, realtime=None, motion_gate=False, name=None):
+        self.detector = detector
+        self.source = source
+        self.roi = roi
+        self.window_s = window_s
+        self.realtime = realtime if realtime is not None else isinstance(source, str) and os.path.isfile(source)
+        self.motion_gate = motion_gate
+        self.name = name or str(source)
+
+        self._lock = threading.Lock()
+        self._frame_ready = threading.Condition(self._lock)
+        self._latest = None  # (frame, video_index, capture_time) not yet analysed
+        self._stop_event = threading.Event()
+        self._source_ended = False
+        self._finished = threading.Event()
+        self._threads = []
+        self.error = None
+
+        # (capture_time, count) with decreasing counts: the front is the window's peak
+        self._window = collections.deque()
+        self.last_count = 0
+        self.last_capture_time = None
+
+        self.frames_read = 0
+        self.frames_dropped = 0
+        self.frames_analysed = 0
+        self.latency_sum = 0.0
+        self.max_latency = 0.0
+        self.start_time = None
+
+    def start(self):
+        cap = open_capture(self.source)
+        self.start_time = time.monotonic()
+        for target, args in ((self._capture, (cap,)), (self._analyse, ())):
+            thread = threading.Thread(target=self._run, args=(target,) + args, name=f"{self.name}-{target.__name__}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        with self._frame_ready:
+            self._frame_ready.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+
+    @property
+    def ended(self):
+        """True once analysis has stopped: the source ran out, stop() was called or a thread failed"""
+        return self._finished.is_set()
+
+    def _run(self, target, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            self.error = e
+            self._stop_event.set()
+
+    def _capture(self, cap):
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        video_index = 0
+        try:
+            while not self._stop_event.is_set():
+                ret, frame = cap.read()
+                if not ret:
+                    break
+                now = time.monotonic()
+                if self.realtime:
+                    # Deliver file frames no faster than the camera they stand in for would
+                    delay = self.start_time + video_index / fps - now
+                    if delay > 0:
+                        time.sleep(delay)
+                        now = time.monotonic()
+                frame = cv2.resize(frame, (640, 480))
+                with self._frame_ready:
+                    if self._latest is not None:
+                        self.frames_dropped += 1
+                    self._latest = (frame, video_index, now)
+                    self.frames_read += 1
+                    self._frame_ready.notify()
+                video_index += 1
+        finally:
+            cap.release()
+            with self._frame_ready:
+                self._source_ended = True
+                self._frame_ready.notify_all()
+
+    def _analyse(self):
+        ct = self.detector._new_tracker()
+        gate = self.detector._new_motion_gate(self.roi) if self.motion_gate else None
+        detections = NO_DETECTIONS
+        previous_index = -1
+        try:
+            while True:
+                with self._frame_ready:
+                    while self._latest is None and not self._source_ended and not self._stop_event.is_set():
+                        self._frame_ready.wait(0.1)
+                    if self._latest is None or self._stop_event.is_set():
+                        return
+                    frame, video_index, captured = self._latest
+                    self._latest = None
+
+                [detections], _ = self.detector._detect_batch([frame], self.roi, gate, detections)
+                # Dropped frames still count towards the tracker's motion prediction
+                count = len(ct.update(detections[0], video_index - previous_index))
+                previous_index = video_index
+                self._record(captured, count)
+        finally:
+            self._finished.set()
+
+    def _record(self, captured, count):
+        now = time.monotonic()
+        with self._lock:
+            window = self._window
+            while window and window[-1][1] <= count:
+                window.pop()
+            window.append((captured, count))
+            self._expire(now)
+            self.last_count = count
+            self.last_capture_time = captured
+            self.frames_analysed += 1
+            latency = now - captured
+            self.latency_sum += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def _expire(self, now):
+        window = self._window
+        while window and window[0][0] < now - self.window_s:
+            window.popleft()
+
+    def current_count(self):
+        """Peak tracked vehicle count over the last window_s seconds"""
+        with self._lock:
+            self._expire(time.monotonic())
+            return self._window[0][1] if self._window else 0
+
+    def current_green_time(self):
+        """Green time in seconds for the current rolling-window count"""
+        return calculate_green_time(self.current_count())
+
+    def data_age(self):
+        """Seconds since the newest analysed frame was captured, or None before the first one"""
+        with self._lock:
+            if self.last_capture_time is None:
+                return None
+            return time.monotonic() - self.last_capture_time
+
+    def stats(self):
+        with self._lock:
+            elapsed = time.monotonic() - self.start_time if self.start_time is not None else 0.0
+            return {
+                "frames_read": self.frames_read,
+                "frames_analysed": self.frames_analysed,
+                "frames_dropped": self.frames_dropped,
+                "drop_fraction": self.frames_dropped / self.frames_read if self.frames_read else 0.0,
+                "analysed_fps": self.frames_analysed / elapsed if elapsed > 0 else 0.0,
+                "mean_latency_s": self.latency_sum / self.frames_analysed if self.frames_analysed else 0.0,
+                "max_latency_s": self.max_latency,
+            }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from vehicle_detection import VehicleDetector
+
+    parser = argparse.ArgumentParser(description="Live rolling-window green times for one or more video sources")
+    parser.add_argument("sources", nargs="+", help="camera indices, stream URLs or video files (one per road)")
+    parser.add_argument("--model", default="yolov8n.pt", help="YOLOv8 weights")
+    parser.add_argument("--window", type=float, default=30.0, help="rolling window in seconds")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between printed updates")
+    args = parser.parse_args()
+
+    detector = VehicleDetector(model_path=args.model)
+    monitors = [LiveRoadMonitor(detector, source, window_s=args.window).start() for source in args.sources]
+    try:
+        while any(not monitor.ended for monitor in monitors):
+            time.sleep(args.interval)
+            print("  ".join(f"{monitor.name}: {monitor.current_count()} vehicles, "
+                            f"{monitor.current_green_time()}s" for monitor in monitors))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for monitor in monitors:
+            monitor.stop()
+        for monitor in monitors:
+            print(monitor.name, monitor.stats())
@@ -2,9 +2,21 @@ from tkinter import *
 from tkinter import filedialog, messagebox, ttk
 from PIL import Image, ImageTk
 import os
-from vehicle_detection import VehicleDetector
-import threading
-import time
+from vehicle_detection import MISSING_ULTRALYTICS, DownloadProgressDialog, VehicleDetector, load_rois
+from detection_cache import DetectionCache
+from junction_controller import JunctionController, Road
+from signal_canvas import SignalBoard, SignalHead
+from event_log import EventLog, TextLogView
+
+# Optional per-road ROI polygons: {"North": [[x, y], ...], ...} in 640x480 frame pixels
+ROI_CONFIG = "rois.json"
+
+# Lines kept in the on-screen log; every event is also written to logs/events.jsonl
+LOG_MAX_LINES = 1000
+
+# Road status text and colour for each signal state
+STATUS_TEXT = {"green": ("GREEN for {}s", "#059669"), "yellow": ("YELLOW for {}s", "#D97706"),
+               "red": ("RED", "#DC2626"), "off": ("Not Processed", "gray")}
 
 class DynamicSignalsApp:
     def __init__(self, root):
@@ -45,6 +57,7 @@ class DynamicSignalsApp:
         self.signal_frames = []
         self.signal_images = []
         self.signal_canvases = []
+        self.signal_heads = []
         self.light_positions = [
             {"red": (50, 50, 30), "yellow": (50, 100, 30), "green": (50, 150, 30)},  # Road 1
             {"red": (50, 50, 30), "yellow": (50, 100, 30), "green": (50, 150, 30)},  # Road 2
@@ -72,12 +85,15 @@ class DynamicSignalsApp:
             canvas = Canvas(frame, width=200, height=300, bg="white", highlightthickness=0)
             canvas.pack(fill=BOTH, expand=True, padx=10, pady=10)
             
-            # Create default traffic signal with all lights off
-            self.draw_traffic_signal(canvas, "off", "off", "off")
+            # Draw the traffic signal once, with all lights off; state changes only recolour it
+            self.signal_heads.append(SignalHead(canvas))
             
             self.signal_frames.append(frame)
             self.signal_canvases.append(canvas)
         
+        # Signal changes are applied together, in one pass when Tk is next idle
+        self.signal_board = SignalBoard(self.root, self.signal_heads)
+        
         # Configure grid weights
         self.signals_frame.grid_rowconfigure(0, weight=1)
         self.signals_frame.grid_rowconfigure(1, weight=1)
@@ -120,6 +136,20 @@ class DynamicSignalsApp:
                               padx=15, pady=8, cursor="hand2")
         self.clear_btn.pack(side=LEFT, padx=5)
         
+        # Analyse all four videos at once in a process pool
+        self.parallel_var = BooleanVar(value=False)
+        self.parallel_check = Checkbutton(self.button_frame, text="Parallel analysis", 
+                                        variable=self.parallel_var, font=('Helvetica', 11), 
+                                        bg=self.bg_color, fg=self.text_color)
+        self.parallel_check.pack(side=LEFT, padx=5)
+        
+        # Analyse each road while the road before it is green
+        self.overlap_var = BooleanVar(value=False)
+        self.overlap_check = Checkbutton(self.button_frame, text="Overlap with green", 
+                                       variable=self.overlap_var, font=('Helvetica', 11), 
+                                       bg=self.bg_color, fg=self.text_color)
+        self.overlap_check.pack(side=LEFT, padx=5)
+        
         # Logs section
         log_frame = LabelFrame(self.controls_frame, text="System Logs", font=('Helvetica', 12, 'bold'), 
                              bg="white", fg=self.title_color, bd=2, relief=RIDGE)
@@ -133,119 +163,78 @@ class DynamicSignalsApp:
         self.log_text.configure(yscrollcommand=scroll.set)
         scroll.pack(side=RIGHT, fill=Y)
         
+        # Log from any thread: the panel is updated in batches on a timer and
+        # events are written to a rotating JSON-lines file in the background
+        self.event_log = EventLog()
+        self.log_view = TextLogView(self.log_text, max_lines=LOG_MAX_LINES)
+        self.event_log.add_handler(self.log_view)
+        self.root.protocol("WM_DELETE_WINDOW", self.close)
+        
         # Initialize detector - PASS THE ROOT WINDOW AS PARAMETER
-        self.detector = VehicleDetector(self.root)
+        # The model loads and warms up in the background so the window is usable at once
+        self.detector = VehicleDetector(self.root, lazy=True,
+                                        log=self.log,
+                                        cache=DetectionCache())
+        # Road names and their regions of interest (None analyses the whole frame)
+        self.road_names = ["North", "East", "South", "West"]
+        rois = load_rois(ROI_CONFIG) if os.path.exists(ROI_CONFIG) else {}
+        self.road_rois = [rois.get(name) for name in self.road_names]
         self.current_road = None
         self.emergency_flag = False
         self.running = False
         
+        # The junction controller runs the signal phases on Tk timers, so the main loop never blocks
+        self.controller = None
+        
         # Add a welcome message
         self.log("Welcome to Dynamic Traffic Signal System")
         self.log("Press 'Start Traffic Control' to begin")
-
-    def draw_traffic_signal(self, canvas, red_state, yellow_state, green_state):
-        # Clear the canvas
-        canvas.delete("all")
-        
-        # Draw signal housing
-        canvas.create_rectangle(25, 25, 75, 175, fill="#333333", outline="black", width=2)
-        
-        # Draw lights
-        # Red light
-        if red_state == "on":
-            red_color = "#FF0000"  # Bright red
-        else:
-            red_color = "#441111"  # Dark red (off)
-        canvas.create_oval(35, 35, 65, 65, fill=red_color, outline="black")
+        if rois:
+            self.log(f"Regions of interest loaded for: {', '.join(rois)}")
         
-        # Yellow light
-        if yellow_state == "on":
-            yellow_color = "#FFFF00"  # Bright yellow
-        else:
-            yellow_color = "#444411"  # Dark yellow (off)
-        canvas.create_oval(35, 85, 65, 115, fill=yellow_color, outline="black")
-        
-        # Green light
-        if green_state == "on":
-            green_color = "#00FF00"  # Bright green
-        else:
-            green_color = "#114411"  # Dark green (off)
-        canvas.create_oval(35, 135, 65, 165, fill=green_color, outline="black")
-        
-        # Draw road indication
-        canvas.create_rectangle(25, 185, 75, 220, fill="#bbbbbb", outline="black")
-        canvas.create_line(50, 185, 50, 220, fill="white", width=2, dash=(5, 3))
+        self.log("Loading detection model in the background...")
+        self.download_dialog = None
+        self.detector.load_async(on_ready=lambda error: self.root.after(0, self._model_loaded, error),
+                                 on_download=lambda: self.root.after(0, self._model_downloading))
 
-    def log(self, message):
-        timestamp = time.strftime("%H:%M:%S")
-        self.log_text.insert(END, f"[{timestamp}] {message}\n")
-        self.log_text.see(END)
+    def _model_downloading(self):
+        self.log("Downloading YOLOv8 model. Please wait...")
+        self.download_dialog = DownloadProgressDialog(self.root)
 
-    def activate_green_signal(self, road_index, duration):
-        """Show green signal for the specified duration"""
-        if not self.running:
-            return
-            
-        road_name = ["North", "East", "South", "West"][road_index]
-        
-        # Turn on green light
-        self.log(f"GREEN signal for {road_name} Road: {duration} seconds")
-        self.status_labels[road_index].config(text=f"GREEN for {duration}s", fg="#059669")
-        
-        canvas = self.signal_canvases[road_index]
-        self.draw_traffic_signal(canvas, "off", "off", "on")
-        
-        # Keep the green light on for the duration
-        end_time = time.time() + duration
-        while time.time() < end_time and self.running:
-            time.sleep(0.5)
-            self.root.update()
-            
-        if not self.running:
-            return
-        
-        # Yellow light transition
-        self.activate_yellow_signal(road_index)
-        
-        if not self.running:
-            return
-            
-        # Red light
-        self.activate_red_signal(road_index)
+    def _model_loaded(self, error):
+        if self.download_dialog is not None:
+            # The user may have closed it already
+            if self.download_dialog.dialog.winfo_exists():
+                self.download_dialog.complete()
+            self.download_dialog = None
+        if error is None:
+            self.log("Detection model ready")
+        else:
+            self.log(f"Could not load detection model: {error}")
+            if isinstance(error, ImportError):
+                messagebox.showerror("Missing Package", MISSING_ULTRALYTICS)
+            else:
+                messagebox.showerror("Model Error", f"Could not load detection model: {error}")
 
-    def activate_yellow_signal(self, road_index):
-        """Show yellow signal for 5 seconds"""
-        if not self.running:
-            return
-            
-        road_name = ["North", "East", "South", "West"][road_index]
-        
-        # Turn on yellow light
-        self.log(f"YELLOW signal for {road_name} Road: 5 seconds")
-        self.status_labels[road_index].config(text="YELLOW for 5s", fg="#D97706")
-        
-        canvas = self.signal_canvases[road_index]
-        self.draw_traffic_signal(canvas, "off", "on", "off")
-        
-        # Keep the yellow light on for 5 seconds
-        start_time = time.time()
-        while time.time() < start_time + 5 and self.running:
-            time.sleep(0.5)
-            self.root.update()
+    def log(self, message, **fields):
+        """Log an event from any thread; fields are saved with it in the event file"""
+        self.event_log.log(message, **fields)
 
-    def activate_red_signal(self, road_index):
-        """Show red signal"""
-        if not self.running:
-            return
-            
-        road_name = ["North", "East", "South", "West"][road_index]
-        
-        # Turn on red light
-        self.log(f"RED signal for {road_name} Road")
-        self.status_labels[road_index].config(text="RED", fg="#DC2626")
-        
-        canvas = self.signal_canvases[road_index]
-        self.draw_traffic_signal(canvas, "on", "off", "off")
+    def close(self):
+        self.running = False
+        if self.controller is not None:
+            self.controller.cancel()
+        self.log_view.close()
+        self.event_log.close()
+        self.root.destroy()
+
+    def show(self, road_index, state, duration=None):
+        """Show a road's signal state (the controller's signal output)"""
+        text, color = STATUS_TEXT[state]
+        self.status_labels[road_index].config(text=text.format(duration), fg=color)
+        self.signal_board.set(road_index, state)
+        if state == "green":
+            self.current_road = road_index
 
     def check_emergency(self):
         return self.emergency_flag
@@ -254,92 +243,78 @@ class DynamicSignalsApp:
         self.start_btn.config(state=DISABLED)
         self.running = True
         
-        # Reset all signals to red
-        for i in range(4):
-            self.activate_red_signal(i)
+        # Videos are chosen up front; the controller does the rest on its own thread and Tk timers
+        roads = self._select_roads()
+        if not self.running:
+            return
         
-        # Start in a separate thread to keep UI responsive
-        thread = threading.Thread(target=self._process_junction)
-        thread.daemon = True
-        thread.start()
+        if self.overlap_var.get():
+            # Each road is analysed while the one before it is green
+            mode, measure = "overlap", None
+        elif self.parallel_var.get():
+            # All four videos at once in a process pool
+            mode, measure = "parallel", None
+        else:
+            # One road at a time, showing the analysed video
+            mode, measure = "sequential", self._measure_with_display
+        self.controller = JunctionController(roads, self, self.root.after, self.root.after_cancel,
+                                             detector=self.detector, mode=mode, measure=measure, log=self.log,
+                                             on_measuring=self._road_measuring, on_measured=self._road_processed,
+                                             on_complete=self._sequence_completed)
+        self.controller.start()
 
-    def _process_junction(self):
-        road_times = [0] * 4  # Store green times for each road
-        road_names = ["North", "East", "South", "West"]
-        
-        # Process all roads first
-        for road in range(4):
-            if not self.running:
-                break
-                
-            self.log(f"Please select video for {road_names[road]} Road")
-            self.status_labels[road].config(text="Waiting for video...", fg="blue")
-            self.root.update()  # Update UI
-            
-            # Use a modal dialog that blocks until user selects a file
-            filename = filedialog.askopenfilename(
-                title=f"Select Video for {road_names[road]} Road",
-                filetypes=[("Video files", "*.mp4 *.avi")]
-            )
-            
-            if filename and self.running:
-                self.log(f"Processing {road_names[road]} Road: {os.path.basename(filename)}")
-                self.status_labels[road].config(text="Processing...", fg="orange")
-                self.root.update()  # Update UI
-                
-                # Detect vehicles and calculate green time
-                green_time, emergency = self.detector.detect_vehicles(filename)
-                road_times[road] = green_time
-                
-                if emergency:
-                    self.log(f"⚠️ Emergency vehicle detected on {road_names[road]} Road")
-                
-                self.status_labels[road].config(text=f"Processed: {green_time}s", fg="green")
-                self.log(f"{road_names[road]} Road Green Time: {green_time} seconds")
-            else:
-                if self.running:  # Only show warning if still running
-                    messagebox.showwarning("No File", f"No video selected for {road_names[road]} Road")
-                    self.status_labels[road].config(text="No Video", fg="gray")
-                road_times[road] = 10  # Default time if no video
-        
-        # Execute signal sequence with emergency handling
-        if self.running:
-            self.log("Starting traffic signal sequence")
-            
-            for road in range(4):
-                if not self.running:
-                    break
-                    
-                if road_times[road] > 0:
-                    self.current_road = road
-                    
-                    # Activate green signal for this road
-                    self.activate_green_signal(road, road_times[road])
-                    
-                    # Small delay between roads
-                    if self.running:
-                        time.sleep(2)
-        
-        self.log("Traffic control sequence completed")
+    def _sequence_completed(self):
         self.running = False
-        # Re-enable start button on the main thread
-        self.root.after(0, lambda: self.start_btn.config(state=NORMAL))
+        self.start_btn.config(state=NORMAL)
+
+    def _select_roads(self):
+        """Ask for the video of each road; roads without one get the default green time"""
+        roads = []
+        for road, name in enumerate(self.road_names):
+            filename = ""
+            if self.running:
+                self.log(f"Please select video for {name} Road")
+                self.status_labels[road].config(text="Waiting for video...", fg="blue")
+                filename = filedialog.askopenfilename(
+                    title=f"Select Video for {name} Road",
+                    filetypes=[("Video files", "*.mp4 *.avi")]
+                )
+            if not filename and self.running:  # Only show warning if still running
+                messagebox.showwarning("No File", f"No video selected for {name} Road")
+                self.status_labels[road].config(text="No Video", fg="gray")
+            roads.append(Road(name, filename or None, self.road_rois[road]))
+        return roads
+
+    def _measure_with_display(self, road):
+        """Analyse a road while showing the video (runs on the controller's thread)"""
+        road = self.controller.roads[road]
+        green_time, emergency = self.detector.detect_vehicles(road.source, pipelined=True, roi=road.roi)
+        for stage, stats in getattr(self.detector, "last_pipeline_stats", {}).items():
+            self.log(f"  {stage}: {stats['items_per_s']:.1f} fps, max queue {stats['max_queue_depth']}")
+        return green_time, emergency
+
+    def _road_measuring(self, road):
+        self.status_labels[road].config(text="Processing...", fg="orange")
+
+    def _road_processed(self, road, green_time, emergency):
+        self.status_labels[road].config(text=f"Processed: {green_time}s", fg="green")
 
     def reset_status(self):
         # Stop any running sequence
         self.running = False
+        if self.controller is not None:
+            self.controller.cancel()
         
         # Reset all status labels
         for i, label in enumerate(self.status_labels):
             label.config(text="Not Processed", fg="gray")
         
-        # Clear the log
-        self.log_text.delete(1.0, END)
+        # Clear the log panel (the event file keeps everything)
+        self.log_view.clear()
         self.log("Status reset")
         
         # Reset all signals to off
-        for canvas in self.signal_canvases:
-            self.draw_traffic_signal(canvas, "off", "off", "off")
+        self.signal_board.set_all("off")
         
         # Reset flags
         self.emergency_flag = False
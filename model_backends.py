@@ -0,0 +1,91 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+# Inference backends VehicleDetector can run on. "torch" uses the .pt
+# checkpoint directly; the others run a graph exported from it.
+BACKENDS = ("torch", "onnx", "openvino")
+
+# Export format and runtime package for each exported backend
+_EXPORT_FORMATS = {"onnx": "onnx", "openvino": "openvino"}
+_RUNTIME_PACKAGES = {"torch": "torch", "onnx": "onnxruntime", "openvino": "openvino"}
+
+DEFAULT_CACHE_DIR = ".model_cache"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """SHA-256 hex digest of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def backend_version(backend):
+    """Version string of the runtime package behind backend"""
+    module = __import__(_RUNTIME_PACKAGES[backend])
+    return getattr(module, "__version__", "unknown")
+
+
+def cache_key(model_path, backend, imgsz, int8=False):
+    """Name of the cache entry for one export of model_path
+
+    Covers everything the exported graph depends on: the weights, the
+    static input size, precision and the runtime version.
+    """
+    height, width = imgsz
+    precision = "int8" if int8 else "fp32"
+    version = backend_version(backend).replace(os.sep, "_")
+    return f"{file_hash(model_path)[:16]}-{backend}-{height}x{width}-{precision}-{version}"
+
+
+def exported_model_path(model_path, backend, imgsz=(480, 640), int8=False, cache_dir=DEFAULT_CACHE_DIR,
+                        log=print):
+    """Path of model_path exported for backend, exporting it on first use
+
+    Exports are kept under cache_dir, one entry per cache_key(), so later
+    starts reuse them. For "torch" the checkpoint itself is returned.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend: {backend}")
+    if backend == "torch":
+        if int8:
+            raise ValueError("INT8 quantization needs the openvino backend")
+        return model_path
+    if int8 and backend != "openvino":
+        raise ValueError("INT8 quantization needs the openvino backend")
+
+    entry = os.path.join(cache_dir, cache_key(model_path, backend, imgsz, int8))
+    if os.path.isdir(entry):
+        artifacts = os.listdir(entry)
+        if artifacts:
+            return os.path.join(entry, artifacts[0])
+
+    log(f"Exporting {os.path.basename(model_path)} for {backend} (one-off, cached in {cache_dir})")
+    from vehicle_detection import _import_yolo
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # Export from a private copy of the weights in a scratch directory and
+    # move the finished artifact into place, so a half-written export is
+    # never picked up from the cache
+    scratch = tempfile.mkdtemp(dir=cache_dir)
+    staging = tempfile.mkdtemp(dir=cache_dir)
+    try:
+        weights = os.path.join(scratch, os.path.basename(model_path))
+        shutil.copyfile(model_path, weights)
+        exported = str(_import_yolo()(weights).export(format=_EXPORT_FORMATS[backend], imgsz=list(imgsz),
+                                                      int8=int8, verbose=False))
+        name = os.path.basename(os.path.normpath(exported))
+        shutil.move(exported, os.path.join(staging, name))
+        try:
+            os.rename(staging, entry)
+        except OSError:
+            # Another process finished the same export first
+            shutil.rmtree(staging, ignore_errors=True)
+    finally:
+        shutil.rmtree(scratch, ignore_errors=True)
+        if os.path.isdir(staging):
+            shutil.rmtree(staging, ignore_errors=True)
+    return os.path.join(entry, name)
@@ -0,0 +1,74 @@
+"""Retained-mode traffic signal drawing for Tk canvases"""
+
+# Fill colours per light: (on, off)
+LIGHT_COLORS = {
+    "red": ("#FF0000", "#441111"),
+    "yellow": ("#FFFF00", "#444411"),
+    "green": ("#00FF00", "#114411"),
+}
+LIGHTS = ("red", "yellow", "green")
+
+
+class SignalHead:
+    """One signal head drawn once on a canvas; later state changes only recolour its lights
+
+    x and y are the top-left corner of the 50x195 pixel drawing, so
+    several heads can share a canvas.
+    """
+
+    def __init__(self, canvas, x=25, y=25):
+        self.canvas = canvas
+        self.state = "off"
+
+        # Housing, lights and road marking, created once
+        canvas.create_rectangle(x, y, x + 50, y + 150, fill="#333333", outline="black", width=2)
+        self.lights = {}
+        for i, light in enumerate(LIGHTS):
+            top = y + 10 + 50 * i
+            self.lights[light] = canvas.create_oval(x + 10, top, x + 40, top + 30, fill=LIGHT_COLORS[light][1],
+                                                    outline="black", tags=("light", light))
+        canvas.create_rectangle(x, y + 160, x + 50, y + 195, fill="#bbbbbb", outline="black")
+        canvas.create_line(x + 25, y + 160, x + 25, y + 195, fill="white", width=2, dash=(5, 3))
+
+    def show(self, state):
+        """Light "red", "yellow" or "green" (or none for "off"), touching only the lights that change"""
+        if state == self.state:
+            return
+        for light in (self.state, state):
+            if light in self.lights:
+                on, off = LIGHT_COLORS[light]
+                self.canvas.itemconfigure(self.lights[light], fill=on if light == state else off)
+        self.state = state
+
+
+class SignalBoard:
+    """Batches state changes for a set of signal heads into one update pass
+
+    set() only records the wanted state; the heads are recoloured together
+    from a single after_idle callback on widget, so changing every signal
+    of a junction costs one pass and one redraw however many calls made it.
+    """
+
+    def __init__(self, widget, heads):
+        self.widget = widget
+        self.heads = list(heads)
+        self.pending = {}
+        self.flush_id = None
+
+    def set(self, index, state):
+        self.pending[index] = state
+        if self.flush_id is None:
+            self.flush_id = self.widget.after_idle(self.flush)
+
+    def set_all(self, state):
+        for index in range(len(self.heads)):
+            self.set(index, state)
+
+    def flush(self):
+        """Apply pending states now (also run automatically when Tk is next idle)"""
+        if self.flush_id is not None:
+            self.widget.after_cancel(self.flush_id)
+            self.flush_id = None
+        pending, self.pending = self.pending, {}
+        for index, state in pending.items():
+            self.heads[index].show(state)
@@ -0,0 +1,168 @@
+import heapq
+import itertools
+import threading
+import time
+
+YELLOW_TIME = 5  # Seconds of yellow after every green
+ALL_RED_TIME = 2  # Seconds of red before the next road turns green
+
+
+def build_phase_plan(road_times, yellow_time=YELLOW_TIME, all_red_time=ALL_RED_TIME):
+    """Green -> yellow -> red phases for every road with a green time
+
+    Returns a list of (road_index, state, duration_seconds) tuples in the
+    order they should run.
+    """
+    plan = []
+    for road, green_time in enumerate(road_times):
+        if green_time > 0:
+            plan.append((road, "green", green_time))
+            plan.append((road, "yellow", yellow_time))
+            plan.append((road, "red", all_red_time))
+    return plan
+
+
+class PhaseScheduler:
+    """Runs a phase plan from timer callbacks instead of a sleeping loop
+
+    after(delay_ms, callback) and after_cancel(timer_id) are the timer
+    API to use - Tk's root.after / root.after_cancel in the GUI - so every
+    phase change runs on the thread that owns the timers and nothing
+    blocks in between. Each boundary is scheduled against the plan's
+    start time on a monotonic clock, so timer lateness doesn't accumulate
+    from one phase to the next.
+
+    on_phase(road_index, state, duration) is called at the start of each
+    phase and on_complete() once the last phase has ended.
+    """
+
+    def __init__(self, after, after_cancel, on_phase, on_complete=None, clock=time.monotonic):
+        self.after = after
+        self.after_cancel = after_cancel
+        self.on_phase = on_phase
+        self.on_complete = on_complete
+        self.clock = clock
+        self.plan = []
+        self.index = 0
+        self.deadline = None
+        self.timer_id = None
+
+    @property
+    def running(self):
+        return self.timer_id is not None
+
+    def start(self, plan):
+        """Start running plan now; any plan already running is cancelled"""
+        self.cancel()
+        self.plan = list(plan)
+        self.index = 0
+        self.deadline = self.clock()
+        self._advance()
+
+    def cancel(self):
+        """Stop at once; no further phase or completion callbacks are made"""
+        self.plan = []
+        if self.timer_id is not None:
+            self.after_cancel(self.timer_id)
+            self.timer_id = None
+
+    def _advance(self):
+        self.timer_id = None
+        if self.index >= len(self.plan):
+            if self.on_complete:
+                self.on_complete()
+            return
+
+        road, state, duration = self.plan[self.index]
+        self.index += 1
+        self.deadline += duration
+        self.on_phase(road, state, duration)
+
+        # on_phase may have cancelled or restarted the plan
+        if self.timer_id is None and self.plan:
+            delay_ms = max(0, int(round((self.deadline - self.clock()) * 1000)))
+            self.timer_id = self.after(delay_ms, self._advance)
+
+
+class TimerLoop:
+    """after / after_cancel timers without Tk, for running schedulers headless
+
+    after() and after_cancel() may be called from any thread; callbacks
+    run one at a time on the thread inside run(), as on Tk's main loop,
+    until stop() is called.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._timers = []  # Heap of (due, timer_id, callback, args)
+        self._active = set()
+        self._ids = itertools.count()
+        self._wakeup = threading.Condition()
+        self._stopped = False
+
+    def after(self, delay_ms, callback, *args):
+        with self._wakeup:
+            timer_id = next(self._ids)
+            heapq.heappush(self._timers, (self.clock() + delay_ms / 1000.0, timer_id, callback, args))
+            self._active.add(timer_id)
+            self._wakeup.notify()
+        return timer_id
+
+    def after_cancel(self, timer_id):
+        with self._wakeup:
+            self._active.discard(timer_id)
+
+    def stop(self):
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify()
+
+    def run(self):
+        with self._wakeup:
+            self._stopped = False
+        while True:
+            with self._wakeup:
+                while True:
+                    if self._stopped:
+                        return
+                    # Drop cancelled timers as they reach the front
+                    while self._timers and self._timers[0][1] not in self._active:
+                        heapq.heappop(self._timers)
+                    if not self._timers:
+                        self._wakeup.wait()
+                        continue
+                    delay = self._timers[0][0] - self.clock()
+                    if delay <= 0:
+                        break
+                    self._wakeup.wait(delay)
+                _, timer_id, callback, args = heapq.heappop(self._timers)
+                self._active.discard(timer_id)
+            callback(*args)
+
+
+class VirtualTimerLoop(TimerLoop):
+    """TimerLoop on a simulated clock: run() jumps straight to each timer instead of waiting for it
+
+    Callbacks run in the order they fall due, so hours of timer-driven
+    control take only as long as the callbacks themselves. Everything
+    runs on one thread: call after() before run() or from callbacks.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+        super().__init__(clock=lambda: self.now)
+
+    def run(self, until=None):
+        """Run timers in due order until stop(), until none are left or until the clock reaches until"""
+        self._stopped = False
+        while not self._stopped and self._timers:
+            due, timer_id, callback, args = heapq.heappop(self._timers)
+            if timer_id not in self._active:
+                continue
+            if until is not None and due > until:
+                heapq.heappush(self._timers, (due, timer_id, callback, args))
+                self.now = until
+                return
+            self._active.discard(timer_id)
+            self.now = max(self.now, due)
+            callback(*args)
@@ -2,23 +2,32 @@ import cv2
 import numpy as np
 import os
 from centroid_tracker import CentroidTracker
-from tkinter import messagebox
-import tkinter as tk
-from tkinter import ttk
+from model_backends import BACKENDS, exported_model_path, file_hash
 import threading
 import time
 
-# Import ultralytics
-try:
-    from ultralytics import YOLO
-except ImportError:
-    messagebox.showerror("Missing Package", 
-                        "The 'ultralytics' package is required but not installed.\n"
-                        "Please install it with: pip install ultralytics")
-    raise
+# tkinter and ultralytics (which pulls in torch) are imported only when
+# needed, so importing this module stays cheap and works without a GUI
+
+MISSING_ULTRALYTICS = ("The 'ultralytics' package is required but not installed.\n"
+                       "Please install it with: pip install ultralytics")
+
+def _import_yolo(show_error=False):
+    """Import ultralytics' YOLO class, optionally reporting a missing package in a dialog (Tk thread only)"""
+    try:
+        from ultralytics import YOLO
+    except ImportError:
+        if show_error:
+            from tkinter import messagebox
+            messagebox.showerror("Missing Package", MISSING_ULTRALYTICS)
+        raise
+    return YOLO
 
 class DownloadProgressDialog:
     def __init__(self, parent):
+        import tkinter as tk
+        from tkinter import ttk
+        
         self.dialog = tk.Toplevel(parent)
         self.dialog.title("Downloading YOLOv8 Model")
         self.dialog.geometry("400x150")
@@ -46,6 +55,7 @@ class DownloadProgressDialog:
         self.dialog.protocol("WM_DELETE_WINDOW", self.on_close)
     
     def on_close(self):
+        from tkinter import messagebox
         if not self.download_complete:
             if messagebox.askokcancel("Cancel Download", "Are you sure you want to cancel the download?"):
                 self.dialog.destroy()
@@ -57,24 +67,352 @@ class DownloadProgressDialog:
         self.progress.stop()
         self.dialog.destroy()
 
+# _filter_detections result for a frame with no vehicles
+NO_DETECTIONS = (np.empty((0, 4), dtype=int), np.empty(0, dtype=int), np.empty(0, dtype=np.float32), False)
+
+def calculate_green_time(vehicle_count):
+    """Green time in seconds for a peak vehicle count: 2s per vehicle, clamped to 10-60s"""
+    return min(max(vehicle_count * 2, 10), 60)
+
+class GreenTimeEstimator:
+    """Incremental green-time estimate that knows when it has settled
+
+    Tracks the running peak vehicle count (or, with percentile set, that
+    percentile of the per-frame counts) and the clamped green time it
+    gives. The estimate has converged once the green time has stayed
+    within tolerance seconds of its current value for the last window
+    updates - or straight away when the peak reaches the 60s cap, since a
+    peak can only grow.
+    """
+
+    def __init__(self, tolerance=0, window=150, percentile=None):
+        self.tolerance = tolerance
+        self.window = window
+        self.percentile = percentile
+        self.peak = 0
+        self.histogram = np.zeros(16, dtype=int)
+        self.frames = 0
+        self.green_time = calculate_green_time(0)
+        # Green time the current stable run is measured against, and where that run started
+        self.reference = self.green_time
+        self.stable_since = 0
+
+    def _percentile_count(self):
+        cumulative = np.cumsum(self.histogram)
+        return int(np.searchsorted(cumulative, self.percentile / 100.0 * self.frames))
+
+    def update(self, count):
+        """Add one frame's tracked count; returns the current green time"""
+        self.frames += 1
+        self.peak = max(self.peak, count)
+        if self.percentile is None:
+            estimate = self.peak
+        else:
+            if count >= len(self.histogram):
+                self.histogram = np.concatenate([self.histogram, np.zeros(2 * count, dtype=int)])
+            self.histogram[count] += 1
+            estimate = self._percentile_count()
+
+        self.green_time = calculate_green_time(estimate)
+        if abs(self.green_time - self.reference) > self.tolerance:
+            self.reference = self.green_time
+            self.stable_since = self.frames
+        return self.green_time
+
+    @property
+    def converged(self):
+        if self.percentile is None and self.green_time >= 60:
+            return True
+        return self.frames - self.stable_since >= self.window
+
+def positive_int(text):
+    """argparse type for counts that must be at least 1, such as --stride"""
+    value = int(text)
+    if value < 1:
+        raise ValueError(f"{value} is less than 1")
+    return value
+
+def peak_mode(text):
+    """argparse type for --peak: "max" (None) for the running peak count, else a percentile of per-frame counts"""
+    if text == "max":
+        return None
+    value = float(text)
+    if not 0 < value <= 100:
+        raise ValueError(f"{value} is not a percentile")
+    return value
+
+def strided_max_disappeared(max_disappeared, stride):
+    """Tracker maxDisappeared in analysed frames, so tracks survive max_disappeared video frames at stride"""
+    return max(1, -(-max_disappeared // stride))
+
+class AnalysisCancelled(Exception):
+    """Raised by analyze_video when its cancelled event is set"""
+
+class FrameSampler:
+    """Picks how many frames to advance between analysed frames
+
+    With adaptive set, the stride doubles (up to max_stride) after stable_frames analysed
+    frames in a row whose detection count changed by at most
+    change_threshold, and halves as soon as a bigger change is seen.
+    Otherwise it stays fixed. The tracker's maxDisappeared is rescaled with the stride so tracks
+    survive the same number of video frames whatever the stride.
+    """
+
+    def __init__(self, tracker, stride=1, max_stride=8, adaptive=True, stable_frames=5, change_threshold=1):
+        if stride < 1:
+            raise ValueError(f"Frame stride must be at least 1, got {stride}")
+        self.tracker = tracker
+        self.adaptive = adaptive
+        self.base_max_disappeared = tracker.maxDisappeared
+        self.max_stride = max(stride, max_stride)
+        self.stable_frames = stable_frames
+        self.change_threshold = change_threshold
+        self.stable = 0
+        self.last_detections = None
+        self.stride = 0
+        self._set_stride(stride)
+
+    def _set_stride(self, stride):
+        if stride == self.stride:
+            return
+        self.stride = stride
+        self.tracker.maxDisappeared = strided_max_disappeared(self.base_max_disappeared, stride)
+
+    def update(self, detections):
+        """Feed the detection count of the latest analysed frame; returns the new stride"""
+        if not self.adaptive:
+            return self.stride
+        if self.last_detections is not None and abs(detections - self.last_detections) > self.change_threshold:
+            self.stable = 0
+            self._set_stride(max(1, self.stride // 2))
+        else:
+            self.stable += 1
+            if self.stable >= self.stable_frames:
+                self.stable = 0
+                self._set_stride(min(self.max_stride, self.stride * 2))
+        self.last_detections = detections
+        return self.stride
+
+class RegionOfInterest:
+    """Polygon covering one approach's queue, in 640x480 processing-frame pixels
+
+    Only the polygon's bounding box, grown outwards to multiples of the
+    model stride, is passed to the model, so the crop needs no resizing
+    or padding. Detections whose centroid falls outside the polygon are
+    dropped.
+    """
+
+    def __init__(self, points, frame_size=(640, 480), stride=32):
+        self.points = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+        if len(self.points) < 3:
+            raise ValueError("A region of interest needs at least 3 points")
+        width, height = frame_size
+        self.mask = np.zeros((height, width), dtype=np.uint8)
+        cv2.fillPoly(self.mask, [self.points], 1)
+        self.mask = self.mask.astype(bool)
+
+        x0, y0 = np.clip(self.points.min(axis=0), 0, None)
+        x1, y1 = self.points.max(axis=0) + 1
+        self.bounds = (
+            int(x0 // stride * stride),
+            int(y0 // stride * stride),
+            int(min(-(-x1 // stride) * stride, width)),
+            int(min(-(-y1 // stride) * stride, height)),
+        )
+
+    @property
+    def shape(self):
+        """(height, width) of the crop"""
+        x0, y0, x1, y1 = self.bounds
+        return y1 - y0, x1 - x0
+
+    def key(self):
+        """Stable text form of the polygon, for cache keys"""
+        return " ".join(f"{x},{y}" for x, y in self.points.tolist())
+
+    @classmethod
+    def parse(cls, text):
+        """Build from "x,y x,y x,y ..." as written by key()"""
+        return cls([[int(v) for v in point.split(",")] for point in text.split()])
+
+    def crop(self, frame):
+        x0, y0, x1, y1 = self.bounds
+        return np.ascontiguousarray(frame[y0:y1, x0:x1])
+
+    def contains(self, rects):
+        """Boolean mask of the (N, 4) frame-coordinate boxes whose centroid is inside the polygon"""
+        height, width = self.mask.shape
+        cx = np.clip((rects[:, 0] + rects[:, 2]) // 2, 0, width - 1)
+        cy = np.clip((rects[:, 1] + rects[:, 3]) // 2, 0, height - 1)
+        return self.mask[cy, cx]
+
+class MotionGate:
+    """Cheap frame-differencing test for whether a frame needs the detector
+
+    Each frame (or its ROI crop) is shrunk to a small blurred grayscale
+    copy and compared with the copy of the last frame the detector ran
+    on. If less than min_changed of its pixels differ by more than
+    pixel_delta grey levels, the scene counts as unchanged and the
+    previous detections can be reused. Comparing against the last
+    analysed frame rather than the previous one lets slow movement add
+    up, and the detector still runs at least every max_skip frames.
+    """
+
+    def __init__(self, min_changed=0.002, pixel_delta=25, size=(80, 60), max_skip=30, roi=None):
+        self.min_changed = min_changed
+        self.pixel_delta = pixel_delta
+        self.size = size
+        self.max_skip = max_skip
+        self.roi = roi
+        self.reference = None
+        self.run_length = 0  # Frames skipped since the detector last ran
+        self.checked = 0
+        self.skipped = 0
+        self.check_time = 0.0
+
+    @property
+    def skip_fraction(self):
+        return self.skipped / self.checked if self.checked else 0.0
+
+    def needs_inference(self, frame):
+        """True if frame differs enough from the last analysed frame to run the detector on it"""
+        start = time.perf_counter()
+        if self.roi is not None:
+            frame = self.roi.crop(frame)
+        small = cv2.cvtColor(cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        small = cv2.GaussianBlur(small, (5, 5), 0)
+        self.checked += 1
+
+        needed = True
+        if self.reference is not None and self.run_length < self.max_skip:
+            changed = np.count_nonzero(cv2.absdiff(small, self.reference) > self.pixel_delta)
+            needed = bool(changed >= self.min_changed * small.size)
+        if needed:
+            self.reference = small
+            self.run_length = 0
+        else:
+            self.run_length += 1
+            self.skipped += 1
+        self.check_time += time.perf_counter() - start
+        return needed
+
+def load_rois(path):
+    """Road name -> RegionOfInterest from a JSON file of {"North": [[x, y], ...], ...}"""
+    import json
+    with open(path) as f:
+        return {road: RegionOfInterest(points) for road, points in json.load(f).items()}
+
 class VehicleDetector:
-    def __init__(self, parent_window=None):
+    def __init__(self, parent_window=None, model_path="yolov8n.pt", batch_size=1, tracker_options=None,
+                 lazy=False, log=print, backend="torch", int8=False, cache=None, motion_gate_options=None):
         self.parent_window = parent_window
-        model_path = "yolov8n.pt"  # Using YOLOv8 nano model
-        
-        # Check if model exists
-        if not os.path.exists(model_path):
-            self.download_model(model_path)
-        
-        # Load the YOLOv8 model
-        self.model = YOLO(model_path)
+        self.model_path = model_path  # Using YOLOv8 nano model by default
+        # "torch" runs the checkpoint; "onnx"/"openvino" run a cached export of it (see model_backends)
+        self.backend = backend
+        self.int8 = int8
+        self.imgsz = (480, 640)  # Model input (height, width) for the 640x480 frames
+        self.conf_threshold = 0.5
+        # Optional DetectionCache of per-frame detections, keyed by video content
+        self.cache = cache
+        self._model_id = None
+        self.batch_size = batch_size  # Frames per model call in analyze_video
+        # Keyword arguments for CentroidTracker, e.g. {"assignment": "optimal", "maxDistance": 40}
+        self.tracker_options = tracker_options or {}
+        # Keyword arguments for MotionGate when motion gating is asked for, e.g. {"min_changed": 0.005}
+        self.motion_gate_options = motion_gate_options or {}
+        self.log = log
         
         # Define vehicle and emergency vehicle classes
         # YOLOv8 uses COCO classes by default
         self.vehicle_types = ["car", "bus", "truck", "motorcycle"]  # COCO class names
         self.emergency_types = ["ambulance", "fire engine"]  # Note: might need custom training for these
         
-        self.ct = CentroidTracker()
+        self.ct = self._new_tracker()
+        
+        self._model = None
+        self._model_error = None
+        self._model_ready = threading.Event()
+        self._load_lock = threading.Lock()
+        # The YOLO predictor keeps per-call state, so model calls from several threads take turns
+        self._predict_lock = threading.Lock()
+        self._load_thread = None
+        
+        # With lazy=True the model is loaded by load_async() or on first use
+        if not lazy:
+            # Check if model exists
+            if not os.path.exists(model_path):
+                self.download_model(model_path)
+            self._load_model(show_error=self.parent_window is not None)
+            if self._model_error is not None:
+                raise self._model_error
+    
+    @property
+    def model(self):
+        """The loaded YOLO model; waits for a background load to finish if one is running"""
+        if not self._model_ready.is_set():
+            if self._load_thread is None:
+                self._load_model()
+            self._model_ready.wait()
+        if self._model_error is not None:
+            raise self._model_error
+        return self._model
+    
+    @property
+    def model_ready(self):
+        return self._model_ready.is_set() and self._model_error is None
+    
+    def _load_model(self, warm_up=False, show_error=False):
+        """Import ultralytics and load the model; a failure is kept and raised by the model property
+
+        Only pass show_error on the Tk thread: Tk dialogs cannot be shown from others.
+        """
+        with self._load_lock:
+            if self._model_ready.is_set():
+                return
+            try:
+                YOLO = _import_yolo(show_error=show_error)
+                if not os.path.exists(self.model_path):
+                    # No progress dialog here; YOLO() downloads the weights itself
+                    self.log("Downloading YOLOv8 model. Please wait...")
+                
+                if self.backend != "torch":
+                    if not os.path.exists(self.model_path):
+                        YOLO(self.model_path)  # Downloads the checkpoint to export from
+                    path = exported_model_path(self.model_path, self.backend, self.imgsz, self.int8, log=self.log)
+                else:
+                    path = self.model_path
+                
+                # Load the YOLOv8 model
+                self._model = YOLO(path, task="detect")
+                self._build_class_masks()
+                
+                if warm_up:
+                    # One inference on a blank frame so the first real call doesn't pay for setup
+                    self._model(np.zeros((480, 640, 3), dtype=np.uint8), imgsz=self.imgsz, verbose=False)
+            except Exception as e:
+                self._model_error = e
+            finally:
+                self._model_ready.set()
+    
+    def load_async(self, on_ready=None, on_download=None):
+        """Load and warm up the model on a background thread
+
+        on_ready(error) is called from that thread when loading finishes;
+        error is None on success. If the weights have to be downloaded
+        first, on_download() is called from that thread before, e.g. to
+        show a DownloadProgressDialog. Neither may touch Tk directly: hand
+        the work to the Tk thread with after().
+        """
+        def load():
+            if on_download is not None and not os.path.exists(self.model_path):
+                on_download()
+            self._load_model(warm_up=True)
+            if on_ready:
+                on_ready(self._model_error)
+        
+        self._load_thread = threading.Thread(target=load)
+        self._load_thread.daemon = True
+        self._load_thread.start()
     
     def download_model(self, model_path):
         """Download the YOLOv8 model with progress dialog"""
@@ -85,10 +423,11 @@ class VehicleDetector:
             def download_thread():
                 try:
                     # This will download the model to the current directory
-                    YOLO(model_path)
+                    _import_yolo()(model_path)
                     # Close the dialog when done
                     self.parent_window.after(0, progress_dialog.complete)
                 except Exception as e:
+                    from tkinter import messagebox
                     messagebox.showerror("Download Error", f"Failed to download model: {str(e)}")
                     self.parent_window.after(0, progress_dialog.dialog.destroy)
             
@@ -105,13 +444,54 @@ class VehicleDetector:
             # No parent window, download without dialog
             try:
                 print("Downloading YOLOv8 model. Please wait...")
-                YOLO(model_path)
+                _import_yolo()(model_path)
                 print("Download complete!")
             except Exception as e:
                 raise FileNotFoundError(f"Could not download YOLOv8 model: {str(e)}")
 
-    def detect_vehicles(self, video_path):
+    def detect_vehicles(self, video_path, pipelined=False, trace_path=None, roi=None, motion_gate=False,
+                        decode_process=False):
+        """Show the analysed video and return (green_time, emergency_detected)
+
+        With roi (a RegionOfInterest), only that part of each frame is
+        analysed and only vehicles inside it are counted. With
+        motion_gate, frames that barely changed reuse the last detections
+        instead of running the model (see MotionGate). With pipelined and
+        decode_process, frames are decoded in a separate process and
+        passed through shared memory (see DetectionPipeline).
+        """
         try:
+            if trace_path is not None and motion_gate:
+                raise ValueError("A detection trace needs every frame analysed: turn off motion gating")
+            cached = self.cached_detections(video_path, roi)
+            if cached is not None:
+                # Already analysed: replay the cached detections instead of showing the video again
+                stats = self.analyze_video(video_path, keep_frames=False, cached=cached, trace_path=trace_path,
+                                           roi=roi)
+                self.last_pipeline_stats = {}
+                return stats["green_time"], stats["emergency_detected"]
+            
+            if pipelined:
+                # Decode, inference, tracking and display on separate threads
+                from detection_pipeline import DetectionPipeline
+                # Carried-forward detections of a gated run are not worth caching
+                record = (self.cache is not None and not motion_gate) or trace_path is not None
+                gate = self._new_motion_gate(roi) if motion_gate else None
+                pipeline = DetectionPipeline(self, video_path, display=True, record=record, roi=roi,
+                                             motion_gate=gate, decode_process=decode_process)
+                green_time, emergency_detected = pipeline.run()
+                self.last_pipeline_stats = pipeline.stats()
+                if gate is not None:
+                    self.log(f"Motion gate skipped {gate.skipped} of {gate.checked} frames "
+                             f"({gate.skip_fraction:.0%})")
+                if pipeline.recorded is not None and not pipeline.stop_event.is_set():
+                    if not motion_gate:
+                        self.store_detections(video_path, pipeline.recorded, roi)
+                    if trace_path is not None:
+                        from detection_trace import write_trace
+                        write_trace(trace_path, pipeline.recorded, self._trace_metadata(video_path, roi))
+                return green_time, emergency_detected
+            
             window_name = "Traffic Detection"
             cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
             
@@ -121,6 +501,10 @@ class VehicleDetector:
                 
             cumulative_count = 0
             emergency_detected = False
+            trace = self._trace_writer(trace_path, video_path, roi)
+            gate = self._new_motion_gate(roi) if motion_gate else None
+            detections = NO_DETECTIONS
+            frame_index = 0
             
             # Define target display size
             display_width, display_height = 640, 480
@@ -137,60 +521,25 @@ class VehicleDetector:
                 # Resize frame for processing and display
                 frame_resized = cv2.resize(frame, (display_width, display_height))
                 
-                # Run YOLOv8 inference on the resized frame
-                results = self.model(frame_resized)
+                # Run YOLOv8 inference on the resized frame, unless the motion gate skips it
+                [detections], _ = self._detect_batch([frame_resized], roi, gate, detections, verbose=True)
+                rects, class_ids, confs, emergency = detections
                 
-                # Process detections
-                rects = []
+                # Check for emergency vehicles
+                if emergency:
+                    emergency_detected = True
                 
-                for r in results:
-                    boxes = r.boxes
-                    for box in boxes:
-                        # Get box coordinates (already in resized frame coordinates)
-                        x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                        x1, y1, x2, y2 = int(x1), int(y1), int(x2), int(y2)
-                        
-                        # Get confidence
-                        conf = float(box.conf[0])
-                        
-                        # Get class name
-                        cls = int(box.cls[0])
-                        class_name = self.model.names[cls]
-                        
-                        # Check if detection is a vehicle and confidence is high enough
-                        if conf > 0.5 and (class_name in self.vehicle_types or class_name in self.emergency_types):
-                            rects.append([x1, y1, x2, y2])
-                            
-                            # Check for emergency vehicles
-                            if class_name in self.emergency_types:
-                                emergency_detected = True
-                            
-                            # Draw bounding box on the resized frame
-                            cv2.rectangle(frame_resized, (x1, y1), (x2, y2), (0, 255, 0), 2)
-                            cv2.putText(frame_resized, f"{class_name} {conf:.2f}", 
-                                      (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+                if trace is not None:
+                    trace.add_frame(frame_index, rects, class_ids, confs)
+                frame_index += 1
                 
                 # Update centroid tracker with scaled rectangles
                 objects = self.ct.update(rects)
                 count = len(objects)
                 cumulative_count = max(cumulative_count, count)
                 
-                # Draw centroids on the resized frame
-                for (objectID, centroid) in objects.items():
-                    cv2.circle(frame_resized, (centroid[0], centroid[1]), 4, (0, 255, 0), -1)
-                    cv2.putText(frame_resized, f"ID {objectID}", (centroid[0] - 10, centroid[1] - 10),
-                              cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
-                
-                # Display vehicle count
-                cv2.putText(frame_resized, f"Current Vehicles: {count}", (10, 30), 
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                cv2.putText(frame_resized, f"Max Vehicles: {cumulative_count}", (10, 60), 
-                          cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
-                
-                # Display emergency vehicle warning
-                if emergency_detected:
-                    cv2.putText(frame_resized, "Emergency Vehicle Detected!", (10, 90), 
-                              cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+                self._draw_frame(frame_resized, rects, class_ids, confs, objects, cumulative_count, emergency_detected,
+                                 roi)
                 
                 cv2.imshow(window_name, frame_resized)
                 
@@ -200,13 +549,473 @@ class VehicleDetector:
             
             cap.release()
             cv2.destroyAllWindows()
+            if trace is not None:
+                trace.close()
+            if gate is not None:
+                self.log(f"Motion gate skipped {gate.skipped} of {gate.checked} frames ({gate.skip_fraction:.0%})")
             
             # Calculate green time based on vehicle count
-            green_time = min(max(cumulative_count * 2, 10), 60)  # Min 10 sec, max 60 sec
+            green_time = calculate_green_time(cumulative_count)  # Min 10 sec, max 60 sec
             
             return green_time, emergency_detected
             
         except Exception as e:
             print(f"Detection Error: {e}")
+            from tkinter import messagebox
             messagebox.showerror("Detection Error", str(e))
-            return 10, False  # Default values in case of error6
\ No newline at end of file
+            return 10, False  # Default values in case of error6
+
+    def predict(self, frames, verbose=False, roi=None):
+        """Run the model on one frame or a list of 640x480 frames
+
+        With roi, the model only sees each frame's ROI crop; boxes in the
+        results are then relative to the crop (see _filter_detections).
+        """
+        # Exported backends have a fixed input size, so always ask for it explicitly
+        imgsz = self.imgsz
+        if roi is not None:
+            frames = roi.crop(frames) if isinstance(frames, np.ndarray) else [roi.crop(f) for f in frames]
+            # PyTorch runs the stride-aligned crop as is; exported graphs letterbox it into their fixed input
+            if self.backend == "torch":
+                imgsz = roi.shape
+        model = self.model
+        with self._predict_lock:
+            return model(frames, imgsz=imgsz, verbose=verbose)
+
+    def _draw_frame(self, frame, rects, class_ids, confs, objects, cumulative_count, emergency_detected, roi=None):
+        """Draw boxes, tracked IDs and the count/emergency overlay onto frame in place"""
+        if roi is not None:
+            cv2.polylines(frame, [roi.points], True, (255, 255, 0), 2)
+        for (x1, y1, x2, y2), cls, conf in zip(rects.tolist(), class_ids.tolist(), confs.tolist()):
+            # Draw bounding box on the resized frame
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0, 255, 0), 2)
+            cv2.putText(frame, f"{self.model.names[cls]} {conf:.2f}", 
+                      (x1, y1 - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+        
+        # Draw centroids on the resized frame
+        for (objectID, centroid) in objects.items():
+            cv2.circle(frame, (centroid[0], centroid[1]), 4, (0, 255, 0), -1)
+            cv2.putText(frame, f"ID {objectID}", (centroid[0] - 10, centroid[1] - 10),
+                      cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 0), 2)
+        
+        # Display vehicle count
+        cv2.putText(frame, f"Current Vehicles: {len(objects)}", (10, 30), 
+                  cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        cv2.putText(frame, f"Max Vehicles: {cumulative_count}", (10, 60), 
+                  cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
+        
+        # Display emergency vehicle warning
+        if emergency_detected:
+            cv2.putText(frame, "Emergency Vehicle Detected!", (10, 90), 
+                      cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
+
+    def _new_tracker(self):
+        return CentroidTracker(**self.tracker_options)
+
+    def _new_motion_gate(self, roi=None):
+        return MotionGate(roi=roi, **self.motion_gate_options)
+
+    def _detect_batch(self, frames, roi=None, gate=None, last=NO_DETECTIONS, verbose=False):
+        """_filter_detections tuples for each of frames, in order, and which frames went through the model
+
+        Frames the motion gate finds unchanged skip the model and reuse
+        the detections of the frame before them (last for the first one);
+        the others go through the model in a single call.
+        """
+        needed = [gate is None or gate.needs_inference(frame) for frame in frames]
+        inferred = [frame for frame, need in zip(frames, needed) if need]
+        results = iter(self.predict(inferred, verbose=verbose, roi=roi) if inferred else ())
+        detections = []
+        for need in needed:
+            if need:
+                last = self._filter_detections(next(results), roi)
+            detections.append(last)
+        return detections, needed
+
+    def _read_batch(self, cap, batch_size, stride=1, next_index=0):
+        """Decode and resize up to batch_size frames, stride frames apart
+
+        Skipped frames are only grabbed, never decoded. Returns the frames,
+        their indices in the video (fewer at the end of the video) and the
+        index of the next unread frame.
+        """
+        frames = []
+        indices = []
+        while len(frames) < batch_size:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(cv2.resize(frame, (640, 480)))
+            indices.append(next_index)
+            next_index += 1
+            for _ in range(stride - 1):
+                if not cap.grab():
+                    break
+                next_index += 1
+        return frames, indices, next_index
+
+    def _build_class_masks(self):
+        """Boolean lookup tables indexed by class ID for the vehicle/emergency class names"""
+        names = self._model.names
+        size = max(names) + 1
+        self.vehicle_mask = np.zeros(size, dtype=bool)
+        self.emergency_mask = np.zeros(size, dtype=bool)
+        for cls, class_name in names.items():
+            if class_name in self.vehicle_types or class_name in self.emergency_types:
+                self.vehicle_mask[cls] = True
+            if class_name in self.emergency_types:
+                self.emergency_mask[cls] = True
+
+    def _filter_detections(self, result, roi=None):
+        """Vehicle boxes above the confidence threshold in one YOLO result
+
+        The boxes' coordinates, confidences and classes are copied to the
+        host and filtered with the precomputed class masks. For a result of predict(..., roi=roi),
+        boxes are moved back to frame coordinates and those centred outside
+        the ROI polygon are dropped. Returns (rects, class_ids, confidences,
+        emergency) where rects is an (N, 4) int array of x1, y1, x2, y2.
+        """
+        # Named columns: the raw boxes.data gains a track ID column before conf and cls when tracking
+        boxes = result.boxes
+        class_ids = boxes.cls.cpu().numpy().astype(int)
+        confs = boxes.conf.cpu().numpy()
+        keep = (confs > self.conf_threshold) & self.vehicle_mask[class_ids]
+        rects = boxes.xyxy.cpu().numpy()[keep].astype(int)
+        class_ids = class_ids[keep]
+        confs = confs[keep]
+        if roi is not None:
+            x0, y0 = roi.bounds[:2]
+            rects += (x0, y0, x0, y0)
+            inside = roi.contains(rects)
+            rects, class_ids, confs = rects[inside], class_ids[inside], confs[inside]
+        emergency = bool(self.emergency_mask[class_ids].any())
+        return rects, class_ids, confs, emergency
+
+    def _detect_frames(self, video_path, batch_size, sampler, progress, roi=None, gate=None):
+        """Run the model over a video; yields (video_index, detections, infer_ms) per analysed frame
+
+        detections is the _filter_detections tuple. Frame, timing and
+        motion-gate skip counters are kept in the progress dict.
+        """
+        detections = NO_DETECTIONS
+        cap = cv2.VideoCapture(video_path)
+        if not cap.isOpened():
+            raise ValueError(f"Could not open video file: {video_path}")
+        try:
+            while True:
+                t0 = time.perf_counter()
+                batch, indices, progress["frames_read"] = self._read_batch(
+                    cap, batch_size, sampler.stride, progress["frames_read"])
+                if not batch:
+                    break
+                t1 = time.perf_counter()
+
+                # One model call for the whole batch (less any frames the motion gate skips);
+                # results come back in frame order
+                batch_detections, needed = self._detect_batch(batch, roi, gate, detections)
+                t2 = time.perf_counter()
+                detections = batch_detections[-1]
+                inferred = sum(needed)
+                progress["decode_s"] += t1 - t0
+                progress["infer_s"] += t2 - t1
+                progress["skipped"] += len(batch) - inferred
+                infer_ms = (t2 - t1) * 1000.0 / inferred if inferred else 0.0
+
+                for video_index, frame_detections, need in zip(indices, batch_detections, needed):
+                    yield video_index, frame_detections, infer_ms if need else 0.0
+        finally:
+            cap.release()
+
+    def _replay_frames(self, cached, sampler, progress):
+        """Like _detect_frames, but from cached per-frame detections instead of the video"""
+        video_index = 0
+        while video_index < len(cached):
+            rects, class_ids, confs = cached[video_index]
+            emergency = bool(self.emergency_mask[class_ids].any())
+            yield video_index, (rects, class_ids, confs, emergency), 0.0
+            video_index += sampler.stride
+        progress["frames_read"] = len(cached)
+
+    def model_id(self):
+        """Identity of the weights and backend, for cache keys"""
+        if self._model_id is None:
+            # Waits for the model if it is still loading: a first run may still be downloading the weights
+            self.model
+            precision = "int8" if self.int8 else "fp32"
+            self._model_id = f"{file_hash(self.model_path)[:16]}-{self.backend}-{precision}"
+        return self._model_id
+
+    def _cache_key(self, video_path, roi=None):
+        return self.cache.key(video_path, self.model_id(), self.imgsz, self.conf_threshold,
+                              self.vehicle_types + self.emergency_types, roi.key() if roi is not None else None)
+
+    def cached_detections(self, video_path, roi=None):
+        """Cached per-frame detections for video_path, or None; logs the hit or miss"""
+        if self.cache is None:
+            return None
+        cached = self.cache.get(self._cache_key(video_path, roi), video_path)
+        stats = self.cache.stats()
+        if cached is None:
+            self.log(f"Detection cache miss for {os.path.basename(video_path)} "
+                     f"(hits {stats['hits']}, misses {stats['misses']})")
+        else:
+            self.log(f"Detection cache hit for {os.path.basename(video_path)}: inference skipped "
+                     f"(hits {stats['hits']}, misses {stats['misses']}, "
+                     f"{stats['bytes_saved'] / 1e6:.1f} MB of video saved)")
+        return cached
+
+    def store_detections(self, video_path, detections, roi=None):
+        """Cache the per-frame (rects, class_ids, confidences) of every frame of video_path"""
+        if self.cache is not None:
+            self.cache.put(self._cache_key(video_path, roi), detections)
+
+    def _trace_metadata(self, video_path, roi=None):
+        return {
+            "video": os.path.basename(video_path),
+            "model": self.model_id(),
+            "imgsz": list(self.imgsz),
+            "conf_threshold": self.conf_threshold,
+            "roi": roi.key() if roi is not None else None,
+            "names": {int(cls): name for cls, name in self.model.names.items()},
+        }
+
+    def _trace_writer(self, trace_path, video_path, roi=None):
+        """TraceWriter for trace_path, or None when no trace was asked for"""
+        if trace_path is None:
+            return None
+        from detection_trace import TraceWriter
+        return TraceWriter(trace_path, self._trace_metadata(video_path, roi))
+
+    def analyze_video(self, video_path, keep_frames=True, batch_size=None, stride=1, adaptive_stride=False,
+                      max_stride=8, early_exit=False, tolerance=0, window=150, percentile=None, cached=None,
+                      trace_path=None, roi=None, motion_gate=False, cancelled=None):
+        """Headless analysis: no drawing or display, returns per-frame and per-video stats
+
+        The returned dict holds the same green time / emergency result as
+        detect_vehicles plus class counts, confidences and stage timings.
+        Per-frame stats are kept under "frames" unless keep_frames is False.
+        Frames are run through the model batch_size at a time (defaults to
+        the detector's batch_size) and tracked in frame order afterwards.
+        Only every stride-th frame is decoded and analysed; with
+        adaptive_stride the stride moves between 1 and max_stride with how
+        much the scene is changing. With early_exit, reading stops as soon
+        as the green time has stayed within tolerance seconds for window
+        analysed frames (see GreenTimeEstimator). With a detection cache,
+        a previously analysed video is replayed from the cache without
+        decoding or inference; cached passes detections already fetched
+        with cached_detections(). With trace_path, every frame's filtered
+        detections are also written there as a detection trace for offline
+        replay (see detection_trace). With roi (a RegionOfInterest), only
+        the ROI crop is run through the model and only vehicles inside the
+        polygon are counted. With motion_gate, analysed frames that barely
+        differ from the last inferred one reuse its detections instead of
+        running the model (see MotionGate). Once the cancelled event is set,
+        the analysis stops at the next frame with AnalysisCancelled. Errors
+        are raised rather than shown in a dialog.
+        """
+        if stride < 1:
+            raise ValueError(f"Frame stride must be at least 1, got {stride}")
+        if trace_path is not None and (stride != 1 or adaptive_stride or motion_gate):
+            raise ValueError("A detection trace needs every frame analysed: use stride 1 without adaptive "
+                             "stride or motion gating")
+        batch_size = batch_size or self.batch_size
+        names = self.model.names  # Waits for the model if it is still loading
+
+        # Each video gets its own tracker so results don't depend on what ran before
+        ct = self._new_tracker()
+        sampler = FrameSampler(ct, stride, max_stride, adaptive=adaptive_stride)
+        estimator = GreenTimeEstimator(tolerance, window, percentile)
+        progress = {"frames_read": 0, "decode_s": 0.0, "infer_s": 0.0, "skipped": 0}
+
+        if cached is None:
+            cached = self.cached_detections(video_path, roi)
+        if cached is not None:
+            source = self._replay_frames(cached, sampler, progress)
+            recorded = None
+        else:
+            gate = self._new_motion_gate(roi) if motion_gate else None
+            source = self._detect_frames(video_path, batch_size, sampler, progress, roi, gate)
+            # Only a full pass over every frame is worth caching
+            full_pass = stride == 1 and not adaptive_stride and not motion_gate
+            recorded = [] if self.cache is not None and full_pass else None
+        trace = self._trace_writer(trace_path, video_path, roi)
+
+        converged = False
+        frames = []
+        class_counts = np.zeros(max(names) + 1, dtype=int)
+        confidence_sum = 0.0
+        cumulative_count = 0
+        emergency_detected = False
+        frame_index = 0
+        previous_index = -1
+        track_time = 0.0
+        start = time.perf_counter()
+
+        for video_index, (rects, class_ids, frame_confs, frame_emergency), infer_ms in source:
+            if cancelled is not None and cancelled.is_set():
+                source.close()
+                if trace is not None:
+                    trace.close(num_frames=previous_index + 1)
+                raise AnalysisCancelled(f"Analysis of {video_path} cancelled")
+            t3 = time.perf_counter()
+            # Frames skipped by the stride still count towards the tracker's motion prediction
+            objects = ct.update(rects, video_index - previous_index)
+            previous_index = video_index
+            count = len(objects)
+            t4 = time.perf_counter()
+            track_time += t4 - t3
+            sampler.update(len(rects))
+            estimator.update(count)
+
+            cumulative_count = max(cumulative_count, count)
+            emergency_detected = emergency_detected or frame_emergency
+            class_counts += np.bincount(class_ids, minlength=len(class_counts))
+            confidence_sum += float(frame_confs.sum())
+            if recorded is not None:
+                recorded.append((rects, class_ids, frame_confs))
+            if trace is not None:
+                trace.add_frame(video_index, rects, class_ids, frame_confs)
+
+            if keep_frames:
+                frames.append({
+                    "frame": video_index,
+                    "tracked": count,
+                    "detections": len(rects),
+                    "classes": [names[cls] for cls in class_ids],
+                    "confidences": frame_confs.tolist(),
+                    "emergency": frame_emergency,
+                    "infer_ms": infer_ms,
+                    "track_ms": (t4 - t3) * 1000.0,
+                })
+            frame_index += 1
+            if early_exit and estimator.converged:
+                # Frames decoded past this point in the batch are not counted
+                progress["frames_read"] = video_index + 1
+                converged = True
+                source.close()
+                break
+
+        if recorded is not None and not converged:
+            self.store_detections(video_path, recorded, roi)
+        if trace is not None:
+            trace.close(num_frames=progress["frames_read"])
+
+        total_time = time.perf_counter() - start
+        frames_read = progress["frames_read"]
+        return {
+            "video": video_path,
+            "frames_processed": frame_index,
+            "frames_read": frames_read,
+            "batch_size": batch_size,
+            "from_cache": cached is not None,
+            "roi": roi.key() if roi is not None else None,
+            "max_vehicles": cumulative_count,
+            "green_time": estimator.green_time,
+            "early_exit": converged,
+            # Analysed frames that reused the previous detections instead of running the model
+            "frames_skipped": progress["skipped"],
+            "skip_fraction": progress["skipped"] / frame_index if frame_index else 0.0,
+            "emergency_detected": emergency_detected,
+            "class_counts": {names[cls]: int(n) for cls, n in enumerate(class_counts) if n},
+            "mean_confidence": confidence_sum / class_counts.sum() if class_counts.any() else 0.0,
+            "timings": {
+                "decode_s": progress["decode_s"],
+                "infer_s": progress["infer_s"],
+                "track_s": track_time,
+                "total_s": total_time,
+                # Video frames covered per second, including skipped ones
+                "fps": frames_read / total_time if total_time > 0 else 0.0,
+            },
+            "frames": frames,
+        }
+
+# Detector owned by each process-pool worker, created by init_worker
+_worker_detector = None
+
+def init_worker(torch_threads=1, model_path="yolov8n.pt", tracker_options=None, backend="torch"):
+    """Process-pool initializer: load one VehicleDetector per worker process
+
+    torch_threads caps the intra-op threads each worker uses so that
+    several workers don't oversubscribe the CPU cores.
+    """
+    global _worker_detector
+    import torch
+    torch.set_num_threads(torch_threads)
+    _worker_detector = VehicleDetector(model_path=model_path, tracker_options=tracker_options, backend=backend)
+
+def analyze_in_worker(video_path, roi=None):
+    """Headless analysis of one video inside a worker started with init_worker"""
+    return _worker_detector.analyze_video(video_path, keep_frames=False, roi=roi)
+
+def analyze_videos_parallel(video_paths, workers=None, torch_threads=None, model_path="yolov8n.pt",
+                            tracker_options=None, backend="torch", rois=None):
+    """Analyse several videos at once in a process pool
+
+    rois optionally gives a RegionOfInterest (or None) per video. Yields
+    (index, stats) as each video finishes, in completion order.
+    Each worker has its own detector and tracker, so the results are the
+    same as calling analyze_video on each video one after another.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+
+    workers = workers or len(video_paths)
+    if torch_threads is None:
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    # Spawn rather than fork: forking a process that already holds torch threads can deadlock
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker,
+                             initargs=(torch_threads, model_path, tracker_options, backend)) as pool:
+        rois = rois or [None] * len(video_paths)
+        futures = {pool.submit(analyze_in_worker, path, roi): index
+                   for index, (path, roi) in enumerate(zip(video_paths, rois))}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    from detection_cache import DetectionCache
+
+    parser = argparse.ArgumentParser(description="Headless vehicle analysis of a video")
+    parser.add_argument("video", help="path to the video file")
+    parser.add_argument("--model", default="yolov8n.pt", help="YOLOv8 weights")
+    parser.add_argument("--backend", choices=BACKENDS, default="torch", help="inference backend")
+    parser.add_argument("--int8", action="store_true", help="INT8-quantized export (openvino only)")
+    parser.add_argument("--frames", action="store_true", help="include per-frame stats in the output")
+    parser.add_argument("--batch-size", type=int, default=1, help="frames per model call")
+    parser.add_argument("--assignment", choices=["greedy", "optimal"], default="greedy",
+                        help="tracker assignment mode")
+    parser.add_argument("--max-distance", type=float, help="tracker gate in pixels")
+    parser.add_argument("--motion-model", choices=["none", "kalman"], default="none",
+                        help="tracker motion model; kalman predicts across skipped frames")
+    parser.add_argument("--stride", type=positive_int, default=1, help="analyse every Nth frame")
+    parser.add_argument("--adaptive-stride", action="store_true", help="adapt the stride to scene changes")
+    parser.add_argument("--early-exit", action="store_true", help="stop once the green time has settled")
+    parser.add_argument("--tolerance", type=float, default=0, help="early exit: allowed green time drift (s)")
+    parser.add_argument("--window", type=int, default=150, help="early exit: analysed frames it must stay stable")
+    parser.add_argument("--peak", type=peak_mode, default=None, metavar="max|PERCENTILE",
+                        help='count the green time is set from: the peak ("max", default) or a percentile '
+                             "of per-frame counts, e.g. 95, which ignores brief spikes")
+    parser.add_argument("--cache-dir", help="cache per-frame detections in this directory")
+    parser.add_argument("--trace", help="write a detection trace for offline replay to this directory")
+    parser.add_argument("--roi", type=RegionOfInterest.parse, help='ROI polygon as "x,y x,y x,y ..." (640x480)')
+    parser.add_argument("--motion-gate", action="store_true", help="skip inference on frames that barely changed")
+    parser.add_argument("--min-changed", type=float, default=0.002,
+                        help="motion gate: fraction of pixels that must change to run the model")
+    args = parser.parse_args()
+
+    tracker_options = {"assignment": args.assignment, "maxDistance": args.max_distance,
+                       "motionModel": args.motion_model}
+    cache = DetectionCache(args.cache_dir) if args.cache_dir else None
+    detector = VehicleDetector(model_path=args.model, batch_size=args.batch_size,
+                               tracker_options=tracker_options, backend=args.backend, int8=args.int8,
+                               cache=cache, motion_gate_options={"min_changed": args.min_changed})
+    stats = detector.analyze_video(args.video, keep_frames=args.frames, stride=args.stride,
+                                   adaptive_stride=args.adaptive_stride, early_exit=args.early_exit,
+                                   tolerance=args.tolerance, window=args.window, percentile=args.peak,
+                                   trace_path=args.trace,
+                                   roi=args.roi, motion_gate=args.motion_gate)
+    print(json.dumps(stats, indent=2))